@@ -98,6 +98,7 @@ class LMSCallbackServer(Thread):
     :const CLIENT_RECONNECT: Captures client reconnect events
     :const CLIENT_FORGET: Captures client forget events
     :const SYNC: Captures sync events
+    :const FAVORITES_CHANGED: Captures changes of the favorites
     :const SERVER_ERROR: Custom event for server errors
     :const SERVER_CONNECT: Custom event for server connection
     """
@@ -133,6 +134,8 @@ class LMSCallbackServer(Thread):
 
     SYNC = "sync"
 
+    FAVORITES_CHANGED = "favorites changed"
+
     def __init__(self,
                  hostname=None,
                  port=9090,
@@ -159,7 +162,8 @@ class LMSCallbackServer(Thread):
             raise CallbackServerError("No server details provided.")
 
         self.__telnet_connect()
-        self.__login()
+        if self.username:
+            self.__login()
         self.is_connected = True
 
     def __disconnect(self):
@@ -176,7 +180,7 @@ class LMSCallbackServer(Thread):
         """
         Login
         """
-        result = self.request("login %s %s" % (self.username, self.password))
+        result = self.__request("login %s %s" % (self.username, self.password))
         self.logged_in = (result == "******")
         if not self.logged_in:
             raise CallbackServerError("Unable to login. Check username and "
@@ -191,7 +195,7 @@ class LMSCallbackServer(Thread):
         # Include a timeout to stop unnecessary blocking
         response = self.telnet.read_until(self.__encode("\n"),timeout=1)[:-1]
         if not preserve_encoding:
-            response = self.__decode(self.__unquote(response))
+            response = self.__unquote(self.__decode(response))
         else:
             command_string_quoted = \
                 command_string[0:command_string.find(':')] + \
@@ -358,7 +362,7 @@ class LMSCallbackServer(Thread):
             try:
                 self.__connect()
                 self.connected = True
-                self.__check_event(CallbackServer.SERVER_CONNECT)
+                self.__check_event(self.SERVER_CONNECT)
                 break
             except CallbackServerError:
                 raise
@@ -386,11 +390,11 @@ class LMSCallbackServer(Thread):
                 # We've got a notification, so let's see if it's one we're
                 # watching.
                 if data:
-                    self.__check_event(data)
+                    self.__check_event(self.__decode(data))
 
             # Server is unavailable so exit gracefully
             except EOFError:
-                self.__check_event(CallbackServer.SERVER_ERROR)
+                self.__check_event(self.SERVER_ERROR)
                 self.run()
 
         self.__disconnect()
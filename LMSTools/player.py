@@ -36,6 +36,8 @@ class LMSPlayer(LMSUtils):
     server.
     """
 
+    SNAPSHOT_PREFIX = "snapshot-"
+
     def __init__(self, ref, server, do_update=True, name=None):
         self.server = server
         self.ref = ref
@@ -92,6 +94,15 @@ class LMSPlayer(LMSUtils):
         Send the request to the server."""
         return self.server.request(self.ref, command)
 
+    def request_batch(self, commands):
+        """
+        :type commands: list
+        :param commands: commands to be sent to server in this order
+        :rtype: list
+        :returns: JSON responses in the order of the commands
+        Send several commands back to back."""
+        return self.server.request_batch(self.ref, commands)
+
     def parse_request(self, command, key):
         """
         :type command: str, list
@@ -472,6 +483,55 @@ class LMSPlayer(LMSUtils):
         # item = self.quote(item)
         self.request("playlist insert {}".format(item))
 
+    def playlist_enqueue(self, commands, rollback=True, position=None):
+        """
+        Add several items to the playlist with back-to-back requests
+        :type commands: list
+        :param commands: commands which add items, e.g. "playlist add <item>"
+        :type rollback: bool
+        :param rollback: whether the items added by this call are removed again if a command added no track
+        :type position: int
+        :param position: playlist index where the commands put the items (e.g. after the current track for
+            "playlist insert <item>"); the end of the playlist if None
+        :rtype: list
+        :returns: number of tracks added by each command in the order of the commands (None if unknown)
+        Each command is followed by "playlist tracks ?" in the same sequence of requests, so commands which
+        add several tracks (e.g. a whole album) are reported correctly.
+        """
+        start = self.track_count
+        batch = list()
+        for command in commands:
+            batch += [command, "playlist tracks ?"]
+        try:
+            results = self.request_batch(batch)
+        except (requests.exceptions.RequestException, ValueError):
+            results = list()
+
+        added = list()
+        count = start
+        for result in results[1::2]:
+            try:
+                new_count = int(result.get("_tracks"))
+            except (AttributeError, TypeError, ValueError):
+                new_count = count
+            added.append(new_count - count)
+            count = new_count
+        added += [None] * (len(commands) - len(added))
+        if rollback and not all(added):
+            first = start if position is None else position
+            self.playlist_erase_range(first, first + self.track_count - start)
+        return added
+
+    def playlist_erase_range(self, start, end):
+        """
+        Remove items from playlist by index range
+        :type start: int
+        :param start: index of the first item to delete
+        :type end: int
+        :param end: index after the last item to delete
+        """
+        self.request_batch(["playlist delete {}".format(index) for index in reversed(range(start, end))])
+
     def playlist_delete(self, item):
         """
         Delete item
@@ -503,6 +563,58 @@ class LMSPlayer(LMSUtils):
         """
         self.request("playlist delete {}".format(index))
 
+    def snapshot(self, name=None):
+        """
+        Save the current playlist, position and volume on the server
+        :type name: str
+        :param name: name of the saved playlist (default "snapshot-<MAC address>")
+        :rtype: dict
+        :returns: snapshot which can be passed to restore
+        The playlist is saved with "playlist save", so the snapshot needs two requests whatever the
+        length of the playlist. A player synced to a master only saves its volume, because the
+        playlist belongs to the sync group.
+        """
+        status = self.request("status - 1") or dict()
+        snapshot = {'playlist': None,
+                    'index': int(status.get('playlist_cur_index') or 0),
+                    'time': float(status.get('time') or 0),
+                    'volume': int(status.get('mixer volume') or 0),
+                    'mode': status.get('mode'),
+                    'synced': status.get('sync_master', self.ref) != self.ref}
+        if not snapshot['synced'] and int(status.get('playlist_tracks') or 0):
+            snapshot['playlist'] = name or "{}{}".format(self.SNAPSHOT_PREFIX, self.ref.replace(":", ""))
+            self.request(["playlist", "save", snapshot['playlist'], "silent:1"])
+        return snapshot
+
+    def restore(self, snapshot):
+        """
+        Restore a snapshot and delete its saved playlist
+        :type snapshot: dict
+        :param snapshot: snapshot returned by snapshot
+        "playlist resume" with noplay:1 already goes back to the track which was current when the
+        playlist was saved, so only a playing snapshot sends "play" and seeks to its time. A paused or
+        stopped snapshot stays silent.
+        """
+        commands = [["mixer", "volume", str(snapshot['volume'])]]
+        if snapshot['playlist']:
+            commands.append(["playlist", "resume", snapshot['playlist'], "wipePlaylist:1", "noplay:1"])
+            if snapshot['mode'] == "play":
+                commands += ["play", "time {}".format(snapshot['time'])]
+        self.request_batch(commands)
+        if snapshot['playlist']:
+            self.delete_saved_playlist(snapshot['playlist'])
+
+    def delete_saved_playlist(self, name):
+        """
+        Delete a saved playlist of the server
+        :type name: str
+        :param name: exact name of the saved playlist
+        """
+        result = self.server.request(params=["playlists", "0", "100", "search:{}".format(name)]) or dict()
+        for playlist_dict in result.get('playlists_loop', list()):
+            if playlist_dict.get('playlist') == name:
+                self.server.request(params=["playlists", "delete", "playlist_id:{}".format(playlist_dict['id'])])
+
     @property
     def volume(self):
         """
@@ -4,8 +4,10 @@ This code uses the JSON interface.
 """
 
 import requests
+import threading
+import time
 from .player import LMSPlayer
-from typing import Union
+from typing import Iterator, Union
 
 
 class LMSConnectionError(Exception):
@@ -26,6 +28,17 @@ class LMSServer(object):
         self._version = None
         self.id = 1
         self.url = f"http://{username}:{password}@{host}:{port}/jsonrpc.js"
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Keep-alive HTTP session. Every thread gets its own session, so requests can be sent concurrently.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
 
     def request(self, player: str = "-", params: Union[str, list] = None) -> dict:
         """
@@ -41,11 +54,53 @@ class LMSServer(object):
                 "method": "slim.request",
                 "params": cmd}
 
-        req = requests.get(self.url, headers={'Content-Type': 'application/json'}, json=data)
+        req = self.session.get(self.url, headers={'Content-Type': 'application/json'}, json=data)
         response = req.json()
         self.id += 1
         return response.get("result")
 
+    def request_batch(self, player: str = "-", commands: list = None) -> list:
+        """
+        :param player: MAC address of a connected player or "-" for server level requests
+        :param commands: list of commands which are sent in this order
+        :returns: list of results in the order of the commands
+        Send several commands back to back over the keep-alive connection of this thread.
+        """
+        return [self.request(player, command) for command in commands or []]
+
+    def request_pages(self, command: str, loop_name: str, tagged_params: list = None, player: str = "-",
+                      page_size: int = 500, min_page_size: int = 50, max_page_size: int = 10000,
+                      target_time: float = 0.5) -> Iterator[dict]:
+        """
+        :param command: Listing command without range, e.g. "titles" or "favorites items"
+        :param loop_name: Name of the result loop in the response, e.g. "titles_loop"
+        :param tagged_params: Tagged parameters appended to each request, e.g. ["tags:e"]
+        :param player: MAC address of a connected player or "-" for server level requests
+        :param page_size: Number of items requested with the first page
+        :param min_page_size: Lower bound for the adaptive page size
+        :param max_page_size: Upper bound for the adaptive page size
+        :param target_time: Response time in seconds each page should take
+        :returns: generator of item dictionaries
+        Yield the items of a listing command page by page. The page size is doubled if the server answers
+        much faster than target_time and halved if it answers much slower, so only one page is held in memory.
+        """
+        start = 0
+        while True:
+            began = time.monotonic()
+            result = self.request(player, command.split() + [str(start), str(page_size)] + (tagged_params or []))
+            elapsed = time.monotonic() - began
+            if not result:
+                return
+            items = result.get(loop_name) or []
+            yield from items
+            start += len(items)
+            if not items or start >= int(result.get('count', 0)):
+                return
+            if elapsed < target_time / 2:
+                page_size = min(page_size * 2, max_page_size)
+            elif elapsed > target_time * 2:
+                page_size = max(page_size // 2, min_page_size)
+
     def get_players(self) -> list:
         """
         :returns: list of LMSPlayer instances
@@ -86,6 +141,15 @@ class LMSServer(object):
             count = 0
         return count
 
+    def get_last_scan(self):
+        """
+        :returns: timestamp of the last library scan or None if it is unknown
+        """
+        try:
+            return self.request(params="serverstatus 0 0").get("lastscan")
+        except (LMSConnectionError, requests.ConnectionError, AttributeError):
+            return None
+
     def get_sync_groups(self) -> list:
         """
         :returns: list of syncgroups. Each group is a list of references of the members.
@@ -32,6 +32,7 @@ class LMSTags(object):
     :const LYRICS: Lyrics. Only if known.
     :const MODIFICATION_TIME: Date and time song file was last changed.
     :const MUSICMAGIC_MIXABLE: 1 if track is mixable, otherwise 0.
+    :const PLAY_COUNT: Number of times the song was played, if known and greater than 0.
     :const RATING: Song rating, if known and greater than 0.
     :const REMOTE_TITLE: Title of the internet radio station.
     :const REMOTE: If 1, this is a remote track.
@@ -67,6 +68,7 @@ class LMSTags(object):
     MODIFICATION_TIME = "n"
     REMOTE_TITLE = "N"
     CONTENT_TYPE = "o"
+    PLAY_COUNT = "O"
     GENRE_ID = "p"
     GENRE_ID_LIST = "P"
     DISC_COUNT = "q"
@@ -4,9 +4,11 @@ import paho.mqtt.client as mqtt
 import json
 import toml
 import configparser
-import uuid
+import lmsactors
 import lmscontroller
+import lmsnormaliser
 import re
+import threading
 
 
 USERNAME_INTENTS = "domi"
@@ -47,32 +49,33 @@ def get_slots(data):
 
 def msg_result_site_info(*args):
     data = json.loads(args[2].payload.decode("utf-8"))
-    if not lmsctl.sites_dict.get(data['site_id']):
-        lmsctl.sites_dict[data['site_id']] = lmscontroller.Site()
-    lmsctl.sites_dict[data['site_id']].update(data, lmsctl.server)
+    lmsctl.update_site(data)
 
 
 def msg_inject_names(client, userdata, msg):
     data = json.loads(msg.payload.decode("utf-8"))
     end_session(client, data['sessionId'])
+    # Collecting the names takes long, so it must not block the MQTT loop
+    threading.Thread(target=inject_names, args=(client, data), daemon=True).start()
 
-    err, operations = lmsctl.get_inject_operations(get_slots(data).get('type'))
+
+def inject_names(client, data):
+    slot_dict = get_slots(data)
+    err, operations, vocabulary = lmsctl.get_inject_operations(slot_dict.get('type'), bool(slot_dict.get('reset')))
     if err:
         notify(client, err, data['siteId'])
         return
 
-    request_id = str(uuid.uuid4())
-    lmsctl.inject_siteids_dict[request_id] = data['siteId']
-    payload = {'id': request_id, 'operations': operations}
-    mqtt_client.publish('hermes/injection/perform', json.dumps(payload))
+    lmsctl.start_injection(
+        operations, vocabulary, data['siteId'],
+        on_finished=lambda job: notify(client, "Das Einlesen wurde erfolgreich abgeschlossen.", job.site_id),
+        on_failed=lambda job: notify(client, "Das Einlesen ist fehlgeschlagen.", job.site_id)
+    )
 
 
 def msg_injection_complete(client, userdata, msg):
     data = json.loads(msg.payload.decode("utf-8"))
-    if data['requestId'] in lmsctl.inject_siteids_dict:
-        site_id = lmsctl.inject_siteids_dict[data['requestId']]
-        del lmsctl.inject_siteids_dict[data['requestId']]
-        notify(client, "Das Einlesen wurde erfolgreich abgeschlossen.", site_id)
+    lmsctl.injection_completed(data['requestId'])
 
 
 def msg_result_device_connect(client, userdata, msg):
@@ -84,25 +87,9 @@ def msg_result_device_connect(client, userdata, msg):
 
     client.publish(f'squeezebox/request/oneSite/{site.site_id}/siteInfo')
 
-    if site.pending_action:
-        request_siteid = site.pending_action.get('request_siteid')
-        slot_dict = site.pending_action.get('slot_dict')
-        device = site.pending_action.get('device')
-        site.pending_action = dict()
-        request_site = lmsctl.sites_dict.get(request_siteid)
-        if not request_site:
-            return
-
-        device.bluetooth['is_connected'] = data['result']
-        request_site.need_connection_queue.remove(device)
-
-        if data['result'] and len(request_site.need_connection_queue) == 0:
-            print("Connection queue is now empty: next step")
-            err = lmsctl.make_devices_ready(slot_dict, request_siteid)
-            if err:
-                notify(mqtt_client, err, request_siteid)
-        elif not data['result']:
-            request_site.action_target = None
+    request_siteid, err = lmsctl.device_connected(data)
+    if err:
+        notify(mqtt_client, err, request_siteid)
 
 
 def msg_result_device_disconnect(client, userdata, msg):
@@ -115,16 +102,14 @@ def msg_result_device_disconnect(client, userdata, msg):
     client.publish(f'squeezebox/request/oneSite/{site.site_id}/siteInfo')
     client.publish(f'squeezebox/request/oneSite/{site.site_id}/serviceStop')
 
-    found = [site.devices_dict[mac] for mac in site.devices_dict
-             if site.devices_dict[mac].bluetooth and
-             data['addr'] == site.devices_dict[mac].bluetooth['addr']]
-    if not found:
+    device = site.bluetooth_devices.get(data['addr'])
+    if not device:
         return
 
-    device = found[0]
-    device.bluetooth['is_connected'] = False
-    if device == site.active_device:
-        site.active_device = None
+    device.bluetooth_connected = False
+    with lmsctl.state_store.lock:
+        if device == site.active_device:
+            site.active_device = None
 
 
 def msg_result_service_start(client, userdata, msg):
@@ -134,32 +119,9 @@ def msg_result_service_start(client, userdata, msg):
     if not site:
         return
 
-    if site.pending_action:
-        request_siteid = site.pending_action.get('request_siteid')
-        slot_dict = site.pending_action.get('slot_dict')
-        device = site.pending_action.get('device')
-        site.pending_action = dict()
-        request_site = lmsctl.sites_dict.get(request_siteid)
-        if not request_site:
-            return
-
-        request_site.need_service_queue.remove(device)
-
-        if data['result'] and device.player.connected:
-            site.active_device = device
-            if len(request_site.need_service_queue) == 0:
-                print("Service queue is now empty: next step")
-                err = lmsctl.make_devices_ready(slot_dict, request_siteid)
-                if err:
-                    notify(mqtt_client, err, request_siteid)
-        elif data['result'] and not device.player.connected:
-            request_site.action_target = None
-            text = f"Das Abspielprogramm wurde im Raum {site.room_name} nicht richtig gestartet."
-            notify(mqtt_client, text, request_siteid)
-        else:
-            request_site.action_target = None
-            text = f"Das Abspielprogramm konnte im Raum {site.room_name} nicht gestartet werden."
-            notify(mqtt_client, text, site.pending_action['request_siteid'])
+    request_siteid, err = lmsctl.service_started(data)
+    if err:
+        notify(mqtt_client, err, request_siteid)
 
 
 def session_started_received(client, userdata, msg):
@@ -167,8 +129,7 @@ def session_started_received(client, userdata, msg):
     site = lmsctl.sites_dict.get(data['siteId'])
     if not site or not site.auto_pause:
         return
-    for device_mac in site.devices_dict:
-        d = site.devices_dict[device_mac]
+    for d in site.devices:
         if d.player.connected and d.player.mode == "play":
             d.auto_pause = True
             d.player.pause()
@@ -179,8 +140,7 @@ def session_ended_received(client, userdata, msg):
     site = lmsctl.sites_dict.get(data['siteId'])
     if not site:
         return
-    for device_mac in site.devices_dict:
-        d = site.devices_dict[device_mac]
+    for d in site.devices:
         if d.player.connected and d.player.mode == "pause" and d.auto_pause:
             d.auto_pause = False
             d.player.play(1.1)
@@ -238,8 +198,7 @@ def msg_queue_restart(client, userdata, msg):
 def no_autostart_after_session(site_id):
     site = lmsctl.sites_dict.get(site_id)
     if site and site.auto_pause:
-        for device_mac in site.devices_dict:
-            d = site.devices_dict[device_mac]
+        for d in site.devices:
             if d.auto_pause:
                 d.auto_pause = False
 
@@ -248,9 +207,11 @@ def msg_music(client, userdata, msg):
     data = json.loads(msg.payload.decode("utf-8"))
     no_autostart_after_session(data['siteId'])
     slot_dict = get_slots(data)
+    # Resolve the content while the devices are being prepared
+    resolution = lmsctl.resolve_speculatively("music", slot_dict)
     err = lmsctl.make_devices_ready(slot_dict, data['siteId'],
                                     target=lmsctl.music,
-                                    args=(slot_dict, data['siteId']))
+                                    args=(slot_dict, data['siteId'], resolution))
     end_session(client, data['sessionId'], err)
 
 
@@ -258,9 +219,11 @@ def msg_podcast(client, userdata, msg):
     data = json.loads(msg.payload.decode("utf-8"))
     no_autostart_after_session(data['siteId'])
     slot_dict = get_slots(data)
+    # Resolve the content while the devices are being prepared
+    resolution = lmsctl.resolve_speculatively("podcast", slot_dict)
     err = lmsctl.make_devices_ready(slot_dict, data['siteId'],
                                     target=lmsctl.podcast,
-                                    args=(slot_dict, data['siteId']))
+                                    args=(slot_dict, data['siteId'], resolution))
     end_session(client, data['sessionId'], err)
 
 
@@ -268,9 +231,11 @@ def msg_radio(*args):
     data = json.loads(args[2].payload.decode("utf-8"))
     no_autostart_after_session(data['siteId'])
     slot_dict = get_slots(data)
+    # Resolve the content while the devices are being prepared
+    resolution = lmsctl.resolve_speculatively("radio", slot_dict)
     err = lmsctl.make_devices_ready(slot_dict, data['siteId'],
                                     target=lmsctl.radio,
-                                    args=(slot_dict, data['siteId']))
+                                    args=(slot_dict, data['siteId'], resolution))
     end_session(args[0], data['sessionId'], err)
 
 
@@ -305,36 +270,67 @@ def dialogue(client, session_id, text, intent_filter, custom_data=None):
     client.publish('hermes/dialogueManager/continueSession', json.dumps(data))
 
 
+def msg_metrics(client, userdata, msg):
+    """
+    Answers with the depth and service times of the site mailboxes and the hit rate of the search cache.
+    It runs directly on the MQTT network thread, so it also answers if all workers are busy.
+    """
+    payload = {'mailboxes': mailboxes.metrics, 'search_cache': lmsctl.search_cache.metrics}
+    client.publish('squeezebox/answer/metrics', json.dumps(payload))
+
+
+def site_mailbox(handler):
+    """
+    Returns a message callback which puts the message into the mailbox of its site,
+    so the handler runs on the worker pool instead of the MQTT network thread.
+    """
+    def callback(client, userdata, msg):
+        try:
+            data = json.loads(msg.payload.decode("utf-8"))
+            site_id = data.get('siteId') or data.get('site_id')
+        except (ValueError, AttributeError):
+            site_id = None
+        mailboxes.submit(site_id, handler, client, userdata, msg)
+    return callback
+
+
 def on_connect(*args):
     client = args[0]
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxInjectNames'), msg_inject_names)
-    client.message_callback_add('hermes/injection/complete', msg_injection_complete)
+    client.message_callback_add('hermes/injection/complete', site_mailbox(msg_injection_complete))
     client.subscribe('hermes/injection/complete')
 
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxPlayerPause'), msg_player_pause)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxPlayerPlay'), msg_player_play)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxPlayerVolume'), msg_player_volume)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxPlayerSync'), msg_player_sync)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxPlayerInfo'), msg_player_info)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxQueueNext'), msg_queue_next)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxQueuePrevious'), msg_queue_previous)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxQueueRestart'), msg_queue_restart)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxMusic'), msg_music)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxPodcast'), msg_podcast)
-    client.message_callback_add('hermes/intent/' + add_prefix('squeezeboxRadio'), msg_radio)
+    intent_handlers = {
+        'squeezeboxInjectNames': msg_inject_names,
+        'squeezeboxPlayerPause': msg_player_pause,
+        'squeezeboxPlayerPlay': msg_player_play,
+        'squeezeboxPlayerVolume': msg_player_volume,
+        'squeezeboxPlayerSync': msg_player_sync,
+        'squeezeboxPlayerInfo': msg_player_info,
+        'squeezeboxQueueNext': msg_queue_next,
+        'squeezeboxQueuePrevious': msg_queue_previous,
+        'squeezeboxQueueRestart': msg_queue_restart,
+        'squeezeboxMusic': msg_music,
+        'squeezeboxPodcast': msg_podcast,
+        'squeezeboxRadio': msg_radio,
+    }
+    for intent_name, handler in intent_handlers.items():
+        client.message_callback_add('hermes/intent/' + add_prefix(intent_name), site_mailbox(handler))
     client.subscribe('hermes/intent/#')
 
-    client.message_callback_add('squeezebox/answer/siteInfo', msg_result_site_info)
-    client.message_callback_add('squeezebox/answer/serviceStart', msg_result_service_start)
+    client.message_callback_add('squeezebox/request/metrics', msg_metrics)
+    client.subscribe('squeezebox/request/metrics')
+
+    client.message_callback_add('squeezebox/answer/siteInfo', site_mailbox(msg_result_site_info))
+    client.message_callback_add('squeezebox/answer/serviceStart', site_mailbox(msg_result_service_start))
     client.subscribe('squeezebox/answer/#')
 
-    client.message_callback_add('bluetooth/answer/deviceConnect', msg_result_device_connect)
-    client.message_callback_add('bluetooth/answer/deviceDisconnect', msg_result_device_disconnect)
-    client.message_callback_add('bluetooth/answer/deviceRemove', msg_result_device_disconnect)
+    client.message_callback_add('bluetooth/answer/deviceConnect', site_mailbox(msg_result_device_connect))
+    client.message_callback_add('bluetooth/answer/deviceDisconnect', site_mailbox(msg_result_device_disconnect))
+    client.message_callback_add('bluetooth/answer/deviceRemove', site_mailbox(msg_result_device_disconnect))
     client.subscribe('bluetooth/answer/#')
 
-    client.message_callback_add('hermes/dialogueManager/sessionStarted', session_started_received)
-    client.message_callback_add('hermes/dialogueManager/sessionEnded', session_ended_received)
+    client.message_callback_add('hermes/dialogueManager/sessionStarted', site_mailbox(session_started_received))
+    client.message_callback_add('hermes/dialogueManager/sessionEnded', site_mailbox(session_ended_received))
     client.subscribe('hermes/dialogueManager/sessionStarted')
     client.subscribe('hermes/dialogueManager/sessionEnded')
 
@@ -348,7 +344,22 @@ if __name__ == "__main__":
     lms_host, lms_port = lms_api_location[0].split(':') if lms_api_location else ["localhost", 9000]
     lms_username = config['secret'].get('lms_username')
     lms_password = config['secret'].get('lms_password')
-    lmsctl = lmscontroller.LMSController(mqtt_client, lms_host, lms_port, lms_username, lms_password)
+    normaliser = lmsnormaliser.Normaliser.from_config(config.get('normalisation', dict()))
+    vocabulary_caps = {table_name: int(config.get('vocabulary', dict()).get(f"max_{table_name}", 0))
+                       for table_name in ["titles", "artists", "albums", "genres"]}
+    statistics_tags = config.get('vocabulary', dict()).get('statistics_tags', "O").strip('"')
+    mailboxes = lmsactors.SiteMailboxes()
+    lmsctl = lmscontroller.LMSController(mqtt_client, lms_host, lms_port, lms_username, lms_password,
+                                         normaliser=normaliser, vocabulary_caps=vocabulary_caps,
+                                         statistics_tags=statistics_tags)
+    lmsctl.start_library_preload()
+    lms_cli_port = config['secret'].get('lms_cli_port')
+    if lms_cli_port:
+        lmsctl.start_favorites_listener(int(lms_cli_port.strip('"')))
+    prefetch_interval = int(config.get('podcasts', dict()).get('prefetch_interval', 0))
+    if prefetch_interval:
+        lmsctl.start_episode_prefetch(prefetch_interval,
+                                      int(config['podcasts'].get('prefetch_max_interval', 6 * prefetch_interval)))
 
     # Set up MQTT client
     snips_config = toml.load('/etc/snips.toml')
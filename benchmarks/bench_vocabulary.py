@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Scalability benchmark for building the injection vocabulary.
+A fake LMS with a generated library runs in a separate process. For each library size the
+get_music_* helpers and get_inject_operations are measured: wall time, number of requests,
+peak memory (tracemalloc) and size of the injection payload. Results are printed as JSON.
+
+    python3 benchmarks/bench_vocabulary.py --tracks 100000 1000000 --output results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lmscontroller  # noqa: E402
+from fake_lms import GeneratedLibrary, serve  # noqa: E402
+
+
+def measure(request_counter, function):
+    """
+    :return: result of the function and dictionary with the measurements
+    """
+    with request_counter.get_lock():
+        request_counter.value = 0
+    tracemalloc.start()
+    began = time.perf_counter()
+    result = function()
+    wall_time = time.perf_counter() - began
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'wall_time_s': round(wall_time, 4), 'requests': request_counter.value, 'peak_memory_bytes': peak}
+
+
+def payload_size(entity_name, names):
+    return len(json.dumps({'id': "", 'operations': [('addFromVanilla', {entity_name: names})]}).encode())
+
+
+def run(tracks, duplication, multi_artist, port):
+    request_counter = multiprocessing.Value('i', 0)
+    library = GeneratedLibrary(tracks, duplication, multi_artist)
+    server = multiprocessing.Process(target=serve, args=(port, library, request_counter), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    try:
+        results = {'tracks': tracks, 'duplication': duplication, 'multi_artist': multi_artist, 'categories': dict()}
+        with tempfile.TemporaryDirectory() as directory:
+            controller = lmscontroller.LMSController(None, "127.0.0.1", port, "", "",
+                                                     catalog_path=os.path.join(directory, "catalog.bin"),
+                                                     offload=False)
+            for category, entity_name in [('titles', 'squeezebox_titles'), ('artists', 'squeezebox_artists'),
+                                          ('albums', 'squeezebox_albums'), ('genres', 'squeezebox_genres'),
+                                          ('playlists', 'squeezebox_playlists')]:
+                names, measurement = measure(request_counter, getattr(controller, f"get_music_{category}"))
+                measurement['items'] = len(names)
+                measurement['payload_bytes'] = payload_size(entity_name, names)
+                results['categories'][category] = measurement
+
+            for run_name in ['inject_cold', 'inject_warm']:
+                (err, operations, _), measurement = measure(
+                    request_counter, lambda: controller.get_inject_operations(None, full_reset=True))
+                measurement['payload_bytes'] = len(json.dumps({'id': "", 'operations': operations}).encode())
+                measurement['error'] = err
+                results['categories'][run_name] = measurement
+            controller.catalog.close()
+        return results
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, nargs="+", default=[100000, 1000000], help="library sizes")
+    parser.add_argument("--duplication", type=float, default=0.1, help="share of repeated titles")
+    parser.add_argument("--multi-artist", type=float, default=0.1, help="share of tracks with several artists")
+    parser.add_argument("--port", type=int, default=9099, help="port of the fake LMS")
+    parser.add_argument("--output", help="file for the JSON results (default: stdout)")
+    args = parser.parse_args()
+
+    results = {'python': sys.version.split()[0],
+               'runs': [run(tracks, args.duplication, args.multi_artist, args.port) for tracks in args.tracks]}
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
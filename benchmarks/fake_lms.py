@@ -0,0 +1,127 @@
+"""
+Local fake of the LMS JSON-RPC endpoint serving a generated library.
+Items are computed from their index on request, so libraries with millions of tracks
+need no memory in the server process.
+"""
+
+import json
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GeneratedLibrary:
+    """
+    :param tracks: Number of tracks
+    :param duplication: Share of tracks (0-1) whose title repeats an earlier title
+    :param multi_artist: Share of tracks (0-1) with several artists like "A, B feat. C"
+    """
+
+    def __init__(self, tracks: int, duplication: float = 0.1, multi_artist: float = 0.1):
+        self.tracks = tracks
+        self.duplication = duplication
+        self.multi_artist = multi_artist
+        self.albums = max(tracks // 10, 1)
+        self.artists = max(tracks // 50, 1)
+        self.genres = 40
+        self.playlists = 20
+        self.lastscan = str(1500000000 + tracks)
+
+    @staticmethod
+    def chance(index: int, salt: str) -> float:
+        return zlib.crc32(f"{salt}{index}".encode()) / 2 ** 32
+
+    def title(self, index: int) -> str:
+        if index and self.chance(index, "dup") < self.duplication:
+            index = zlib.crc32(str(index).encode()) % index
+        return f"Titel {index} Über Alles"
+
+    def artist(self, index: int) -> str:
+        name = f"Künstler {index % self.artists}"
+        if self.chance(index, "multi") < self.multi_artist:
+            name += f", Künstler {(index * 31) % self.artists} feat. Gast {index % 7}"
+        return name
+
+    def track(self, index: int, tags: str = "") -> dict:
+        """
+        Like LMS, only the fields whose tags were requested are returned; statistics only if greater than 0.
+        """
+        fields = {'a': ('artist', lambda: self.artist(index)), 'e': ('album_id', lambda: index % self.albums),
+                  'g': ('genre', lambda: f"Genre {index % self.genres}/Pop"),
+                  'l': ('album', lambda: f"Album {index % self.albums}"),
+                  'p': ('genre_id', lambda: index % self.genres), 's': ('artist_id', lambda: index % self.artists),
+                  'R': ('rating', lambda: index % 101), 'O': ('playcount', lambda: index % 13)}
+        track_dict = {'id': index, 'title': self.title(index)}
+        for tag in tags:
+            if tag in fields:
+                key, value = fields[tag]
+                track_dict[key] = value()
+        return {key: value for key, value in track_dict.items() if value or key not in ['rating', 'playcount']}
+
+    def listing(self, command: str, start: int, count: int, tags: str = "") -> dict:
+        if command == "titles":
+            total, loop_name, item = self.tracks, "titles_loop", lambda i: self.track(i, tags)
+        elif command == "albums":
+            total, loop_name = self.albums, "albums_loop"
+            item = lambda i: {'id': i, 'album': f"Album {i}"}
+        elif command == "artists":
+            total, loop_name = min(self.tracks, self.artists * 2), "artists_loop"
+            item = lambda i: {'id': i, 'artist': self.artist(i)}
+        elif command == "genres":
+            total, loop_name = self.genres, "genres_loop"
+            item = lambda i: {'id': i, 'genre': f"Genre {i}/Pop"}
+        else:
+            total, loop_name = self.playlists, "playlists_loop"
+            item = lambda i: {'id': i, 'playlist': f"Playlist {i}"}
+        return {'count': total, loop_name: [item(i) for i in range(start, min(start + count, total))]}
+
+    def handle(self, params: list) -> dict:
+        command = params[0]
+        if command in ["titles", "albums", "artists", "genres", "playlists"]:
+            tags = "".join(param[len("tags:"):] for param in params if param.startswith("tags:"))
+            return self.listing(command, int(params[1]), int(params[2]), tags)
+        if command == "favorites":
+            favorites = [{'id': 'f0', 'name': "Radio Eins", 'isaudio': 1, 'hasitems': 0},
+                         {'id': 'f1', 'name': "Lage der Nation", 'isaudio': 0, 'hasitems': 1,
+                          'url': "https://example.org/lage-der-nation.xml"},
+                         {'id': 'f2', 'name': self.title(1), 'isaudio': 1, 'hasitems': 0}]
+            if any(param.startswith("item_id:") for param in params):
+                # The favorites have no folders and the episodes of the podcast are not generated
+                favorites = list()
+            if len(params) > 3:
+                start, count = int(params[2]), int(params[3])
+                return {'count': len(favorites), 'loop_loop': favorites[start:start + count]}
+            return {'count': len(favorites)}
+        if command == "serverstatus":
+            return {'lastscan': self.lastscan}
+        if command == "info":
+            totals = {'albums': self.albums, 'artists': self.artists, 'songs': self.tracks, 'genres': self.genres}
+            return {'_count': totals.get(params[2], 0)}
+        if command == "player":
+            return {'_count': 0}
+        if command == "version":
+            return {'_version': "8.0.0"}
+        return {}
+
+
+def serve(port: int, library: GeneratedLibrary, request_counter=None):
+    """
+    Serves the library on localhost until the process is terminated.
+    :param request_counter: Optional multiprocessing.Value counting the requests
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if request_counter is not None:
+                with request_counter.get_lock():
+                    request_counter.value += 1
+            body = json.dumps({'id': data['id'], 'result': library.handle(data['params'][1])}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
@@ -0,0 +1,92 @@
+"""
+Per-site mailboxes for the MQTT message handlers.
+Every site has its own mailbox whose messages are handled in order, so the commands of one room
+keep their order. The mailboxes are processed by a shared worker pool, so different rooms are
+handled in parallel and a slow handler does not block the MQTT network thread.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Mailbox:
+    def __init__(self):
+        self.messages = deque()
+        self.scheduled = False
+        self.processed = 0
+        self.failed = 0
+        self.service_time = 0.0
+        self.max_service_time = 0.0
+        self.max_depth = 0
+
+
+class SiteMailboxes:
+    """
+    :param max_workers: Number of worker threads shared by all mailboxes
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="site")
+        self.mailboxes = dict()
+        self.lock = threading.Lock()
+
+    def submit(self, site_id, handler, *args):
+        """
+        Puts a message into the mailbox of a site. The handler is called with the arguments
+        after all earlier messages of this site were handled.
+        :param site_id: siteId of the message; messages without site share one mailbox
+        :param handler: Function which handles the message
+        """
+        with self.lock:
+            mailbox = self.mailboxes.setdefault(site_id, Mailbox())
+            mailbox.messages.append((handler, args))
+            mailbox.max_depth = max(mailbox.max_depth, len(mailbox.messages))
+            if mailbox.scheduled:
+                return
+            mailbox.scheduled = True
+        self.executor.submit(self.process, mailbox)
+
+    def process(self, mailbox: Mailbox):
+        """
+        Handles one message and schedules the mailbox again if there are more, so a busy site
+        cannot occupy a worker while the mailboxes of other sites are waiting.
+        """
+        with self.lock:
+            handler, args = mailbox.messages.popleft()
+        start = time.perf_counter()
+        failed = False
+        try:
+            handler(*args)
+        except Exception as e:
+            failed = True
+            print(f"Handler {getattr(handler, '__name__', handler)} failed: {e!r}")
+        service_time = time.perf_counter() - start
+        with self.lock:
+            mailbox.processed += 1
+            mailbox.failed += failed
+            mailbox.service_time += service_time
+            mailbox.max_service_time = max(mailbox.max_service_time, service_time)
+            if not mailbox.messages:
+                mailbox.scheduled = False
+                return
+        self.executor.submit(self.process, mailbox)
+
+    @property
+    def metrics(self) -> dict:
+        """
+        :return: dictionary with siteId and the depth and service times of its mailbox
+        """
+        with self.lock:
+            return {site_id: {'depth': len(mailbox.messages),
+                              'max_depth': mailbox.max_depth,
+                              'processed': mailbox.processed,
+                              'failed': mailbox.failed,
+                              'mean_service_time': mailbox.service_time / mailbox.processed
+                              if mailbox.processed else 0.0,
+                              'max_service_time': mailbox.max_service_time}
+                    for site_id, mailbox in self.mailboxes.items()}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,66 @@
+"""
+Thread-safe LRU cache with time-to-live for results of slow LMS requests.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    :param maxsize: Maximum number of entries; the least recently used entry is dropped first
+    :param ttl: Default time-to-live of an entry in seconds
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        :return: cached value or default if the key is missing or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl: float = None):
+        """
+        :param ttl: Time-to-live of this entry in seconds; the default ttl if not given
+        """
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """
+        Removes one entry or, without a key, all entries.
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    @property
+    def metrics(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': self.hits / requests if requests else 0.0}
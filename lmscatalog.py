@@ -0,0 +1,314 @@
+"""
+Compact on-disk catalog of the LMS library.
+The catalog file is memory-mapped, so loading it costs almost no heap. Each table of names
+is stored once as a sorted and deduplicated (interned) string table:
+    magic | header length | JSON header | table 1 | table 2 | ...
+A string table consists of count + 1 little-endian uint32 offsets followed by the UTF-8 blob.
+Mapping tables store "key\0value" entries; id tables store the key followed by packed uint32 ids.
+The posting lists of the fuzzy index are stored like id tables (see lmsindex).
+"""
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+
+MAGIC = b"SQBCAT01"
+VERSION = 4
+
+# Number of ids per record of the id tables, e.g. a title record is (track, album, artist, genre)
+ID_FIELDS = {'titles': 4, 'albums': 2, 'artists': 1, 'genres': 1, 'playlists': 1}
+# Tables with case-normalised names for the library snapshot and tables with a fuzzy index
+FOLDED_TABLES = ['titles', 'albums', 'artists', 'genres']
+FUZZY_TABLES = ['artists', 'albums', 'titles', 'genres']
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+class StringTable:
+    """
+    Read-only sequence of sorted unique strings inside a memory-mapped buffer.
+    Strings are decoded lazily on access.
+    """
+
+    def __init__(self, buffer, offset: int, count: int):
+        self.count = count
+        self.offsets = memoryview(buffer)[offset:offset + 4 * (count + 1)].cast("I")
+        self.blob = memoryview(buffer)[offset + 4 * (count + 1):]
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, index: int) -> bytes:
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]])
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("string table index out of range")
+        return self.raw(index).decode("utf-8")
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.raw(index).decode("utf-8")
+
+    def index(self, name: str) -> int:
+        """
+        Binary search for a name. UTF-8 byte order equals code point order, so the table
+        can be searched without decoding it.
+        :return: index of the name or -1
+        """
+        encoded = name.encode("utf-8")
+        keys = _RawKeys(self)
+        position = bisect_left(keys, encoded)
+        if position < self.count and keys[position] == encoded:
+            return position
+        return -1
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self.index(name) >= 0
+
+    def lookup(self, key: str):
+        """
+        Looks up a key in a mapping table, whose entries are "key\0value" strings.
+        :return: value or None
+        """
+        value = self.lookup_raw(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def lookup_raw(self, key: str):
+        """
+        Same as lookup, but returns the undecoded bytes of the value.
+        """
+        value = self.lookup_view(key)
+        return bytes(value) if value is not None else None
+
+    def lookup_view(self, key: str):
+        """
+        Same as lookup_raw, but returns a memoryview of the value inside the catalog, so large
+        values like posting lists are not copied.
+        """
+        prefix = key.encode("utf-8") + b"\0"
+        # Only the first bytes of each entry are compared, so long values are not copied by the search
+        position = bisect_left(_RawKeys(self, len(prefix)), prefix)
+        if position < self.count:
+            start, end = self.offsets[position], self.offsets[position + 1]
+            if self.blob[start:start + len(prefix)] == prefix:
+                return self.blob[start + len(prefix):end]
+        return None
+
+    def keys(self):
+        """Iterates the keys of a mapping table in order."""
+        for index in range(self.count):
+            yield self.raw(index).split(b"\0", 1)[0].decode("utf-8")
+
+    def values(self):
+        """Iterates the values of a mapping table in key order."""
+        for index in range(self.count):
+            yield self.raw(index).split(b"\0", 1)[1].decode("utf-8")
+
+    def release(self):
+        self.offsets.release()
+        self.blob.release()
+
+
+class _RawKeys:
+    """
+    Sequence view of the undecoded strings of a table for bisect.
+    :param width: Number of bytes of each string which are compared; the whole string if None
+    """
+
+    def __init__(self, table: StringTable, width: int = None):
+        self.table = table
+        self.width = width
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, index: int) -> bytes:
+        if self.width is None:
+            return self.table.raw(index)
+        start = self.table.offsets[index]
+        return bytes(self.table.blob[start:min(start + self.width, self.table.offsets[index + 1])])
+
+
+class LibraryCatalog:
+    """
+    Memory-mapped library catalog. The key describes the library state the catalog was
+    built from (e.g. last scan time and totals), so a changed library can be detected.
+    """
+
+    def __init__(self, path: str, file, buffer, header: dict):
+        self.path = path
+        self._file = file
+        self._buffer = buffer
+        self.key = header.get('key')
+        self.tables = {name: StringTable(buffer, info['offset'], info['count'])
+                       for name, info in header.get('tables', dict()).items()}
+
+    def table(self, name: str):
+        return self.tables.get(name, ())
+
+    def resolve(self, table_name: str, canonical_name: str):
+        """
+        :return: original LMS name of a canonical name or None
+        """
+        table = self.tables.get(f"{table_name}_map")
+        return table.lookup(canonical_name) if table else None
+
+    def ids(self, table_name: str, canonical_name: str) -> list:
+        """
+        :return: list of id records of a canonical name, e.g. [(track_id, album_id, artist_id, genre_id)]
+        """
+        table = self.tables.get(f"{table_name}_ids")
+        packed = table.lookup_raw(canonical_name) if table and canonical_name else None
+        if not packed:
+            return list()
+        ids = array('I')
+        ids.frombytes(packed)
+        width = ID_FIELDS[table_name]
+        return [tuple(ids[i:i + width]) for i in range(0, len(ids), width)]
+
+    @staticmethod
+    def id_entries(ids_dict: dict):
+        """Encodes a dictionary with canonical name and array('I') of ids as entries of an id table."""
+        return (key.encode("utf-8") + b"\0" + ids.tobytes() for key, ids in ids_dict.items())
+
+    def canonical_names(self, table_name: str) -> list:
+        """
+        :return: canonical names of a table in the same order as originals()
+        """
+        table = self.tables.get(f"{table_name}_map")
+        return list(table.keys()) if table else list(self.table(table_name))
+
+    def originals(self, table_name: str) -> list:
+        """
+        :return: one original name per canonical name of a table
+        """
+        table = self.tables.get(f"{table_name}_map")
+        return list(table.values()) if table else list(self.table(table_name))
+
+    @staticmethod
+    def mapping_entries(mapping: dict):
+        """Encodes a dictionary as entries of a mapping table."""
+        return (f"{key}\0{value}" for key, value in mapping.items())
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Map a catalog file into memory.
+        :param path: Path of the catalog file
+        :return: catalog or None if the file is missing or invalid
+        """
+        try:
+            file = open(path, "rb")
+        except OSError:
+            return None
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if buffer[:len(MAGIC)] != MAGIC:
+                raise ValueError("no catalog file")
+            header_start = len(MAGIC) + _HEADER_LENGTH.size
+            header_length, = _HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+            header = json.loads(buffer[header_start:header_start + header_length].decode("utf-8"))
+        except (OSError, ValueError, struct.error):
+            file.close()
+            return None
+        # The map keeps its own file descriptor, so the file can be closed right away
+        file.close()
+        return cls(path, file, buffer, header)
+
+    @staticmethod
+    def write(path: str, key: dict, tables: dict):
+        """
+        Write a catalog file atomically.
+        :param path: Path of the catalog file
+        :param key: JSON serialisable description of the library state
+        :param tables: dictionary with table name and iterable of strings or bytes
+        """
+        encoded_tables = dict()
+        for name, values in tables.items():
+            encoded_tables[name] = sorted({value if isinstance(value, bytes) else value.encode("utf-8")
+                                           for value in values if value})
+
+        header = {'key': key, 'tables': dict()}
+        sizes = {name: 4 * (len(values) + 1) + sum(len(v) for v in values) for name, values in encoded_tables.items()}
+
+        # The header contains the table offsets, which depend on the header length itself.
+        # Offsets are padded to 4 bytes, so reserve space for the widest possible numbers.
+        for name, values in encoded_tables.items():
+            header['tables'][name] = {'offset': 2 ** 32 - 1, 'count': len(values)}
+        header_length = len(json.dumps(header).encode("utf-8"))
+        offset = len(MAGIC) + _HEADER_LENGTH.size + header_length
+        for name in encoded_tables:
+            offset += -offset % 4
+            header['tables'][name]['offset'] = offset
+            offset += sizes[name]
+        header_bytes = json.dumps(header).encode("utf-8").ljust(header_length)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(header_length))
+            f.write(header_bytes)
+            for name, values in encoded_tables.items():
+                f.write(b"\0" * (header['tables'][name]['offset'] - f.tell()))
+                position = 0
+                offsets = [0]
+                for value in values:
+                    position += len(value)
+                    offsets.append(position)
+                f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+                f.write(b"".join(values))
+        os.replace(tmp_path, path)
+
+    def close(self):
+        for table in self.tables.values():
+            table.release()
+        self.tables = dict()
+        self._buffer.close()
+        self._file.close()
+
+
+class LibrarySnapshot:
+    """
+    Case-normalised membership tables of the library names. A snapshot is taken once from the
+    catalog and shared by all classification and lookup paths. The tables are sorted string
+    tables of the memory-mapped catalog, so membership is a binary search and needs no heap.
+    """
+
+    def __init__(self, titles=(), albums=(), artists=(), genres=(), key=None):
+        """
+        :param titles: collection of the normalised titles (see normalise); the same for the other tables
+        """
+        self.key = key
+        self.titles = titles
+        self.albums = albums
+        self.artists = artists
+        self.genres = genres
+
+    @classmethod
+    def from_catalog(cls, catalog: LibraryCatalog):
+        return cls(*(catalog.table(f"{table_name}_folded") for table_name in FOLDED_TABLES), catalog.key)
+
+    @staticmethod
+    def normalise(name: str) -> str:
+        return name.strip().casefold()
+
+    def has_title(self, name: str) -> bool:
+        return self.normalise(name) in self.titles
+
+    def has_album(self, name: str) -> bool:
+        return self.normalise(name) in self.albums
+
+    def has_artist(self, name: str) -> bool:
+        return self.normalise(name) in self.artists
+
+    def has_genre(self, name: str) -> bool:
+        return self.normalise(name) in self.genres
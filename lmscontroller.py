@@ -1,12 +1,71 @@
 import LMSTools
+import lmscatalog
+import lmscache
+import lmsindex
+import lmsnormaliser
+import lmsprefetch
+import copy
 import json
-import re
+import heapq
+import multiprocessing
 import random
+import threading
+import time
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Callable
 
 
+# Verbs of the playlist commands which replace the playlist, append to it or insert after the current track
+CONTROL_VERBS = ("load", "add", "insert")
+ITEM_VERBS = ("play", "add", "insert")
+
+
+class DeviceState:
+    """
+    Mutable runtime state of a device, which survives topology updates.
+    """
+
+    def __init__(self):
+        self.auto_pause = False
+        self.bluetooth_connected = False
+
+
+class SiteState:
+    """
+    Mutable runtime state of a site, which survives topology updates.
+    :param lock: Lock of the state store which guards this state
+    """
+
+    def __init__(self, lock=None):
+        self.lock = lock or threading.RLock()
+        self.active_device_mac = None
+        self.on_the_fly_devices = dict()
+
+
+class StateStore:
+    """
+    Runtime state of all sites and devices. The handlers of different sites run in parallel, so
+    the active and on-the-fly devices of a site are only read and changed while holding the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.sites = dict()
+        self.devices = dict()
+
+    def site(self, site_id) -> SiteState:
+        with self.lock:
+            return self.sites.setdefault(site_id, SiteState(self.lock))
+
+    def device(self, mac) -> DeviceState:
+        with self.lock:
+            return self.devices.setdefault(mac, DeviceState())
+
+
 class Device:
-    def __init__(self, player):
+    def __init__(self, player, state: DeviceState = None):
         self.name = player.name
         self.site_id = str()
         self.names_list = [player.name]
@@ -14,64 +73,658 @@ class Device:
         self.bluetooth = dict()
         self.soundcard = str()
         self.player = player
-        self.auto_pause = False
+        self.state = state or DeviceState()
         self.on_the_fly = False
 
+    def __eq__(self, other):
+        # Devices of different topology snapshots are the same device if they have the same player
+        return isinstance(other, Device) and self.player.ref == other.player.ref
+
+    def __hash__(self):
+        return hash(self.player.ref)
+
+    @property
+    def auto_pause(self):
+        return self.state.auto_pause
+
+    @auto_pause.setter
+    def auto_pause(self, auto_pause):
+        self.state.auto_pause = auto_pause
+
+    @property
+    def bluetooth_connected(self):
+        return self.state.bluetooth_connected
+
+    @bluetooth_connected.setter
+    def bluetooth_connected(self, connected):
+        self.state.bluetooth_connected = connected
+
+
+class SiteIndexes:
+    """
+    Indexes of all sites by room and area and the spoken names of all devices.
+    They are updated incrementally by Site.update.
+    """
 
-class Site:
     def __init__(self):
+        self.rooms = dict()
+        self.areas = dict()
+        self.device_names = dict()
+
+    def copy(self):
+        indexes = SiteIndexes()
+        indexes.rooms = {room: dict(sites) for room, sites in self.rooms.items()}
+        indexes.areas = {area: dict(sites) for area, sites in self.areas.items()}
+        indexes.device_names = dict(self.device_names)
+        return indexes
+
+    def move_site(self, site, old_room, old_area):
+        """
+        Moves a site from its old room and area to its current ones.
+        """
+        for index, old_key, new_key in [(self.rooms, old_room, site.room_name), (self.areas, old_area, site.area)]:
+            if old_key is not None and old_key in index:
+                index[old_key].pop(site.site_id, None)
+                if not index[old_key]:
+                    del index[old_key]
+            if new_key is not None:
+                index.setdefault(new_key, dict())[site.site_id] = site
+
+    def rename_device(self, old_names, new_names):
+        """
+        Counts how many devices have a spoken name, so a name is only removed with its last device.
+        """
+        for name in old_names:
+            self.device_names[name] -= 1
+            if not self.device_names[name]:
+                del self.device_names[name]
+        for name in new_names:
+            self.device_names[name] = self.device_names.get(name, 0) + 1
+
+
+class Site:
+    """
+    Configuration of a site. A site which is part of a Topology is never changed; updates are made
+    on a copy. The runtime state is kept in the SiteState, which is shared by all copies.
+    """
+
+    def __init__(self, state: SiteState = None):
         self.room_name = None
         self.site_id = None
         self.area = None
         self.auto_pause = None
         self.default_device_name = None
         self.devices_dict = dict()
-        self.active_device = None
-        self.pending_action = dict()
-        self.need_connection_queue = list()
-        self.need_service_queue = list()
-        self.action_target = None
-        self.action_target_args = None
-
-    def update(self, data, server):
+        self.device_names = dict()
+        self.bluetooth_devices = dict()
+        self.state = state or SiteState()
+
+    def copy(self):
+        """
+        Returns a copy with copied devices, which can be updated without affecting readers of this site.
+        """
+        site = copy.copy(self)
+        site.devices_dict = {mac: copy.copy(device) for mac, device in self.devices_dict.items()}
+        site.device_names = {name: site.devices_dict[device.player.ref] for name, device in self.device_names.items()}
+        site.bluetooth_devices = {addr: site.devices_dict[device.player.ref]
+                                  for addr, device in self.bluetooth_devices.items()}
+        return site
+
+    @property
+    def devices(self) -> list:
+        """
+        :return: configured devices and on-the-fly devices of this site
+        """
+        with self.state.lock:
+            return list(self.devices_dict.values()) + list(self.state.on_the_fly_devices.values())
+
+    def find_device(self, name: str):
+        """
+        :return: configured or on-the-fly device with this spoken name or None
+        """
+        device = self.device_names.get(name)
+        if device:
+            return device
+        with self.state.lock:
+            on_the_fly_devices = list(self.state.on_the_fly_devices.values())
+        for device in on_the_fly_devices:
+            if name in device.names_list:
+                return device
+        return None
+
+    @property
+    def active_device(self):
+        with self.state.lock:
+            mac = self.state.active_device_mac
+            return self.devices_dict.get(mac) or self.state.on_the_fly_devices.get(mac)
+
+    @active_device.setter
+    def active_device(self, device):
+        self.state.active_device_mac = device.player.ref if device else None
+
+    def update(self, data, server, indexes: SiteIndexes = None, state_store=None):
+        """
+        Updates the site from a siteInfo message and keeps the indexes of the site up to date.
+        Only call this on a copy which is not yet part of a Topology.
+        :param data: Data of the siteInfo message
+        :param server: LMSServer object
+        :param indexes: SiteIndexes of all sites
+        :param state_store: StateStore with the runtime state of the devices
+        """
+        old_room, old_area = self.room_name, self.area
         self.room_name = data['room_name']
         self.site_id = data['site_id']
         self.area = data['area']
+        if indexes:
+            indexes.move_site(self, old_room, old_area)
         self.auto_pause = data['auto_pause']
         self.default_device_name = data['default_device']
 
         for device_dict in data['devices']:
-            if not self.devices_dict.get(device_dict['squeezelite_mac']):
-                player = LMSTools.LMSPlayer(device_dict['squeezelite_mac'], server, False, device_dict['name'])
-                self.devices_dict[device_dict['squeezelite_mac']] = Device(player)
+            mac = device_dict['squeezelite_mac']
+            if not self.devices_dict.get(mac):
+                player = LMSTools.LMSPlayer(mac, server, False, device_dict['name'])
+                self.devices_dict[mac] = Device(player, state_store.device(mac) if state_store else None)
 
-            device = self.devices_dict[device_dict['squeezelite_mac']]
+            device = self.devices_dict[mac]
+            if device.site_id:
+                # The device was already indexed, so its old names and address are removed first
+                for name in device.names_list:
+                    if self.device_names.get(name) is device:
+                        del self.device_names[name]
+                if device.bluetooth and self.bluetooth_devices.get(device.bluetooth['addr']) is device:
+                    del self.bluetooth_devices[device.bluetooth['addr']]
+                if indexes:
+                    indexes.rename_device(device.names_list, list())
             device.name = device_dict['name']
             device.site_id = self.site_id
             device.names_list = device_dict['names_list']
             device.synonyms = device_dict['synonyms']
             device.bluetooth = device_dict['bluetooth']
             device.soundcard = device_dict['soundcard']
+            if device.bluetooth:
+                device.bluetooth_connected = bool(device.bluetooth.get('is_connected'))
+            for name in device.names_list:
+                self.device_names.setdefault(name, device)
+            if device.bluetooth:
+                self.bluetooth_devices[device.bluetooth['addr']] = device
+            if indexes:
+                indexes.rename_device(list(), device.names_list)
+
+
+class PendingAction:
+    """
+    Continuation of a request which waits until its devices are ready. Each step (a bluetooth
+    connection or a squeezelite start of one device) has its own correlation id.
+    The squeezelite start of a device only depends on the bluetooth connection of the same device.
+    """
+
+    def __init__(self, request_siteid, slot_dict, target=None, args=()):
+        self.request_siteid = request_siteid
+        self.slot_dict = slot_dict
+        self.target = target
+        self.args = args
+        self.need_connection = dict()
+        self.need_service = dict()
+        self.started = set()
+        self.finished = False
+
+    def ready_steps(self):
+        """
+        :return: list of correlation id, device and phase of the steps whose requests can be sent now
+        """
+        connecting = set(self.need_connection.values())
+        steps = [(cid, device, 'need_connection') for cid, device in self.need_connection.items()]
+        steps += [(cid, device, 'need_service') for cid, device in self.need_service.items()
+                  if device not in connecting]
+        return [step for step in steps if step[0] not in self.started]
+
+
+class Topology:
+    """
+    Immutable snapshot of all sites and their indexes. A siteInfo update builds a new snapshot,
+    which replaces the old one atomically, so readers get a consistent view without locks.
+    """
+
+    def __init__(self, sites: dict = None, indexes: SiteIndexes = None):
+        self.sites = sites if sites is not None else dict()
+        self.indexes = indexes or SiteIndexes()
+
+
+def split_operations(operations: list, max_bytes: int) -> list:
+    """
+    Splits injection operations into chunks whose JSON payload stays below max_bytes.
+    Large entity lists are split as well; only the first part of an 'addFromVanilla'
+    operation keeps that kind, the following parts are sent as 'add'.
+    :param operations: list of (kind, {entity: names}) operations
+    :param max_bytes: Maximum size of the operations of one chunk in bytes
+    :return: list of operation lists
+    """
+    chunks = list()
+    chunk = list()
+    chunk_size = 2
+    for kind, entities in operations:
+        for entity_name, names in entities.items():
+            part_kind = kind
+            part = list()
+            part_size = len(json.dumps([part_kind, {entity_name: []}])) + 2
+            for name in names:
+                name_size = len(json.dumps(name)) + 2
+                if (part or chunk) and chunk_size + part_size + name_size > max_bytes:
+                    if part:
+                        chunk.append((part_kind, {entity_name: part}))
+                        part_kind = 'add'
+                    chunks.append(chunk)
+                    chunk, chunk_size = list(), 2
+                    part = list()
+                    part_size = len(json.dumps([part_kind, {entity_name: []}])) + 2
+                part.append(name)
+                part_size += name_size
+            chunk.append((part_kind, {entity_name: part}))
+            chunk_size += part_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def run_in_worker(method_name: str, controller_args: tuple, controller_kwargs: dict, *args):
+    """
+    Entry point of the worker process. Creates a controller without MQTT client and process pool
+    and calls one of its CPU-bound methods. Only the compact result is sent back.
+    """
+    normaliser_options = controller_kwargs.pop('normaliser_options')
+    controller = LMSController(None, *controller_args, normaliser=lmsnormaliser.Normaliser(**normaliser_options),
+                               offload=False, **controller_kwargs)
+    return getattr(controller, method_name)(*args)
+
+
+class InjectionJob:
+    """
+    An injection which is published as several chunks. Each chunk has its own request id, which
+    is replaced when the chunk is published again.
+    """
+    def __init__(self, site_id, vocabulary, chunks, on_finished=None, on_failed=None):
+        self.site_id = site_id
+        self.vocabulary = vocabulary
+        self.chunks = chunks
+        self.request_ids = [str(uuid.uuid4()) for _ in chunks]
+        self.states = ['waiting'] * len(chunks)
+        self.tries = [0] * len(chunks)
+        self.failed = False
+        self.on_finished = on_finished
+        self.on_failed = on_failed
+
+    def vanilla_entities(self, index):
+        """
+        :return: set of the entities which are reset by the chunk
+        """
+        return {entity_name for kind, entities in self.chunks[index] if kind == 'addFromVanilla'
+                for entity_name in entities}
+
+    def entities(self, index):
+        return {entity_name for _, entities in self.chunks[index] for entity_name in entities}
+
+    @property
+    def in_flight(self):
+        return [index for index, state in enumerate(self.states) if state == 'in_flight']
+
+    @property
+    def finished(self):
+        return all(state == 'completed' for state in self.states)
 
 
 class LMSController:
-    def __init__(self, mqtt_client, lms_host, lms_port, lms_username, lms_password):
+    def __init__(self, mqtt_client, lms_host, lms_port, lms_username, lms_password, catalog_path="catalog.bin",
+                 injection_chunk_bytes=100000, injection_window=2, injection_timeout=120, injection_retries=2,
+                 normaliser=None, vocabulary_caps=None, offload=True, search_cache_size=256, search_cache_ttl=3600,
+                 episodes_cache_ttl=900, favorites_ttl=3600, statistics_tags=LMSTools.LMSTags.PLAY_COUNT):
         self.mqtt_client = mqtt_client
         self.server = LMSTools.LMSServer(lms_host, lms_port, lms_username, lms_password)
-        self.sites_dict = dict()
+        self.server_args = (lms_host, lms_port, lms_username, lms_password)
+        self.topology = Topology()
+        self.topology_lock = threading.Lock()
+        self.state_store = StateStore()
         self.pending_actions = dict()
+        self.pending_lock = threading.Lock()
         self.current_status = dict()
-        self.inject_siteids_dict = dict()
+        self.injection_jobs = dict()
+        self.injection_lock = threading.Lock()
+        self.injection_chunk_bytes = injection_chunk_bytes
+        self.injection_window = injection_window
+        self.injection_timeout = injection_timeout
+        self.injection_retries = injection_retries
+        self.injected_vocabulary = dict()
+        self.catalog_path = catalog_path
+        self.catalog = None
+        self.catalog_lock = threading.Lock()
+        self.library = None
+        self.fuzzy_indexes = dict()
+        self.genre_index = dict()
+        self.normaliser = normaliser or lmsnormaliser.Normaliser()
+        self.vocabulary_caps = {table_name: cap for table_name, cap in (vocabulary_caps or dict()).items() if cap}
+        self.statistics_tags = statistics_tags
+        self.offload = offload
+        self.search_cache = lmscache.LRUCache(search_cache_size, search_cache_ttl)
+        self.episodes_cache_ttl = episodes_cache_ttl
+        self.favorites_index = None
+        self.favorites_index_expiry = 0
+        self.favorites_ttl = favorites_ttl
+        self.favorites_lock = threading.Lock()
+        self.favorites_listener = None
+        self.episode_prefetcher = None
+        self.resolver_pool = ThreadPoolExecutor(max_workers=4)
+        self.process_pool = None
+        self.process_pool_lock = threading.Lock()
+
+    def call_offloaded(self, method_name: str, *args):
+        """
+        Calls a CPU-bound method in a separate worker process, so the GIL of this process stays free
+        for the MQTT loop. Without offloading, the method is called directly.
+        :param method_name: Name of the controller method
+        :param args: Picklable arguments of the method
+        :return: result of the method
+        """
+        if not self.offload:
+            return getattr(self, method_name)(*args)
+        with self.process_pool_lock:
+            if not self.process_pool:
+                self.process_pool = ProcessPoolExecutor(max_workers=2,
+                                                        mp_context=multiprocessing.get_context("spawn"))
+        controller_kwargs = {'catalog_path': self.catalog_path, 'normaliser_options': self.normaliser.options,
+                             'statistics_tags': self.statistics_tags}
+        future = self.process_pool.submit(run_in_worker, method_name, self.server_args, controller_kwargs, *args)
+        return future.result()
+
+    def get_library_key(self) -> dict:
+        """
+        Describes the current state of the LMS library. If the key changes, the catalog is outdated.
+        :return: dictionary with last scan time and library totals
+        """
+        info_types = ["albums", "artists", "songs", "genres"]
+        results = self.fetch_concurrently(dict(
+            {info_type: (lambda t=info_type: self.server.get_info_total(t)) for info_type in info_types},
+            lastscan=self.server.get_last_scan,
+        ))
+        return {
+            'lastscan': results['lastscan'],
+            'totals': {info_type: results[info_type] for info_type in info_types},
+            'normalisation': self.normaliser.options,
+            'version': lmscatalog.VERSION,
+        }
+
+    @staticmethod
+    def fetch_concurrently(fetchers: dict) -> dict:
+        """
+        Runs independent fetch functions in parallel, so the wall time is about the slowest one.
+        :param fetchers: dictionary with name and function without arguments
+        :return: dictionary with name and result of the function
+        """
+        with ThreadPoolExecutor(max_workers=max(len(fetchers), 1)) as executor:
+            futures = {name: executor.submit(fetcher) for name, fetcher in fetchers.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def get_catalog(self, force_rebuild=False):
+        """
+        Returns the memory-mapped library catalog. It is loaded from disk if the library
+        has not changed since it was written, otherwise it is rebuilt from LMS.
+        Only one thread checks or rebuilds the catalog at a time. A new catalog replaces the reference;
+        the old one is not closed, because other threads may still read it. It is unmapped
+        when the last reference is gone.
+        :param force_rebuild: Whether the catalog should be rebuilt in any case
+        :return: LibraryCatalog object
+        """
+        with self.catalog_lock:
+            key = self.get_library_key()
+            if not force_rebuild and self.catalog and self.catalog.key == key:
+                return self.catalog
+
+            if not force_rebuild:
+                catalog = lmscatalog.LibraryCatalog.load(self.catalog_path)
+                if catalog and catalog.key == key:
+                    self.catalog = catalog
+                    return catalog
+                if catalog:
+                    catalog.close()
+
+            print("Library has changed: rebuilding catalog")
+            self.call_offloaded('write_catalog', key)
+            self.catalog = lmscatalog.LibraryCatalog.load(self.catalog_path)
+            return self.catalog
+
+    def write_catalog(self, key: dict):
+        """
+        Fetches, splits, deduplicates and normalises all library names and writes the catalog file.
+        :param key: Library key from get_library_key
+        """
+        sources = self.fetch_concurrently({
+            'titles': lambda: self.collect_table("titles", "titles_loop", "title",
+                                                 ['id', 'album_id', 'artist_id', 'genre_id'], ["tags:esp"]),
+            'artists': lambda: self.collect_table("artists", "artists_loop", "artist", ['id'],
+                                                  split_entity='artists'),
+            'albums': lambda: self.collect_table("albums", "albums_loop", "album", ['id', 'artist_id'],
+                                                 ["tags:lS"]),
+            'genres': lambda: self.collect_table("genres", "genres_loop", "genre", ['id'], split_entity='genres'),
+            'playlists': lambda: self.collect_table("playlists", "playlists_loop", "playlist", ['id']),
+        })
+        tables = dict()
+        for table_name, (names, ids_dict) in sources.items():
+            tables[table_name] = names
+            mapping = self.normaliser.build_mapping(names)
+            tables[f"{table_name}_map"] = lmscatalog.LibraryCatalog.mapping_entries(mapping)
+            tables[f"{table_name}_ids"] = lmscatalog.LibraryCatalog.id_entries(ids_dict)
+            if table_name in lmscatalog.FOLDED_TABLES:
+                tables[f"{table_name}_folded"] = {lmscatalog.LibrarySnapshot.normalise(name) for name in names}
+            if table_name in lmscatalog.FUZZY_TABLES:
+                # Positions refer to the mapping table, whose entries are sorted by their UTF-8 bytes
+                phonetic, postings = lmsindex.build_postings(sorted(mapping, key=lambda key: key.encode("utf-8")))
+                tables[f"{table_name}_phonetic"] = lmscatalog.LibraryCatalog.id_entries(phonetic)
+                tables[f"{table_name}_trigrams"] = lmscatalog.LibraryCatalog.id_entries(postings)
+        lmscatalog.LibraryCatalog.write(self.catalog_path, key, tables)
+
+    def collect_table(self, command: str, loop_name: str, key: str, id_fields: list, tagged_params: list = None,
+                      split_entity: str = None) -> (list, dict):
+        """
+        Collects the unique names of a library listing and the ids of each canonical name.
+        :param id_fields: Keys of the ids in each item, e.g. ['id', 'album_id']; missing ids are stored as 0
+        :return: list of unique names, dictionary with canonical name and flat array('I') of id records
+        """
+        names = dict()
+        ids_dict = dict()
+        for item_dict in self.server.request_pages(command, loop_name, tagged_params):
+            value = item_dict.get(key)
+            if not value:
+                continue
+            # Saved snapshots of the players are no playlists of the user
+            if command == "playlists" and value.startswith(LMSTools.LMSPlayer.SNAPSHOT_PREFIX):
+                continue
+            # Ids like "12,15" for several contributors only keep the first one
+            record = [int(str(item_dict.get(field) or 0).split(',')[0] or 0) for field in id_fields]
+            for name in (self.normaliser.split(split_entity, value) if split_entity else [value]):
+                canonical_name = names.get(name)
+                if canonical_name is None:
+                    canonical_name = names[name] = self.normaliser.canonical(name)
+                if canonical_name:
+                    ids_dict.setdefault(canonical_name, array('I')).extend(record)
+        return list(names), ids_dict
+
+    def resolve_slot(self, table_name: str, value: str) -> str:
+        """
+        Maps a spoken slot value to the original LMS name via its canonical form.
+        No request is sent to LMS; without a loaded catalog the value is returned unchanged.
+        :param table_name: Catalog table, e.g. 'artists'
+        :param value: Slot value from Snips
+        :return: original LMS name or the slot value
+        """
+        canonical_name = self.canonical_slot(table_name, value)
+        if not canonical_name:
+            return value
+        return self.catalog.resolve(table_name, canonical_name)
+
+    def canonical_slot(self, table_name: str, value: str):
+        """
+        Finds the canonical catalog name of a spoken slot value, exactly or with the fuzzy index.
+        :return: canonical name which exists in the catalog or None
+        """
+        if not value or not self.catalog:
+            return None
+        canonical_name = self.normaliser.canonical(value)
+        if self.catalog.resolve(table_name, canonical_name):
+            return canonical_name
+        if self.fuzzy_indexes.get(table_name):
+            original = self.fuzzy_indexes[table_name].resolve(canonical_name)
+            if original:
+                print(f"Resolved '{value}' to '{original}' with the fuzzy index")
+                return self.normaliser.canonical(original)
+        return None
+
+    def build_genre_index(self, catalog: lmscatalog.LibraryCatalog):
+        """
+        Maps every canonical genre name to its original LMS name and genre ids.
+        """
+        self.genre_index = {
+            canonical_name: (original, [record[0] for record in catalog.ids('genres', canonical_name)])
+            for canonical_name, original in zip(catalog.canonical_names('genres'), catalog.originals('genres'))
+        }
+
+    def find_genre(self, value: str):
+        """
+        Validates a spoken genre locally with the genre index.
+        :return: original LMS genre name and list of genre ids, or None if the genre is unknown
+        """
+        if not self.genre_index:
+            self.get_library()
+        canonical_name = self.normaliser.canonical(value)
+        if canonical_name not in self.genre_index:
+            canonical_name = self.canonical_slot('genres', value)
+        return self.genre_index.get(canonical_name)
+
+    def resolve_music_ids(self, artist: str, album: str, title: str):
+        """
+        Maps the slot combination to LMS ids with the catalog, without any request.
+        :return: id name for playlistcontrol (e.g. 'track_id') and list of ids, or None if nothing matches
+        """
+        if not self.catalog:
+            return None
+        artist_ids = {record[0] for record in self.catalog.ids('artists', self.canonical_slot('artists', artist))} \
+            if artist else None
+        album_records = self.catalog.ids('albums', self.canonical_slot('albums', album)) if album else None
+        if artist and not artist_ids or album and not album_records:
+            return None
+        album_ids = {album_id for album_id, album_artist_id in album_records
+                     if artist_ids is None or album_artist_id in artist_ids} if album else None
 
-    def get_inject_operations(self, requested_type: str) -> (str, list):
+        if title:
+            track_ids = [track_id for track_id, track_album_id, track_artist_id, _
+                         in self.catalog.ids('titles', self.canonical_slot('titles', title))
+                         if (album_ids is None or track_album_id in album_ids)
+                         and (artist_ids is None or track_artist_id in artist_ids)]
+            return ('track_id', track_ids) if track_ids else None
+        if album:
+            return ('album_id', sorted(album_ids)) if album_ids else None
+        if artist:
+            return 'artist_id', sorted(artist_ids)
+        return None
+
+    def build_fuzzy_indexes(self, catalog: lmscatalog.LibraryCatalog):
+        """
+        Opens the phonetic and trigram indexes used to resolve misspelled slot values.
+        Their posting lists were built with the catalog in the worker process.
         """
-        Returns a list with operation dictionaries for the snips-injection service,
+        self.fuzzy_indexes = {
+            table_name: lmsindex.FuzzyIndex(catalog.table(f"{table_name}_map"), catalog.table(f"{table_name}_phonetic"),
+                                            catalog.table(f"{table_name}_trigrams"))
+            for table_name in lmscatalog.FUZZY_TABLES if catalog.table(f"{table_name}_trigrams")
+        }
+
+    @staticmethod
+    def play_score(track_dict: dict) -> float:
+        """
+        Ranks a track by its play statistics: play count, rating (0-100) and how recently it was played.
+        Statistics which the server does not report count as zero. LMS reports the play count with the tag
+        LMSTags.PLAY_COUNT; further statistics of plugins can be requested with the statistics_tags option.
+        """
+        play_count = float(track_dict.get('playcount') or 0)
+        rating = float(track_dict.get('rating') or 0) / 20
+        last_played = float(track_dict.get('lastplayed') or 0)
+        recency = 0.0
+        if last_played:
+            days = max(time.time() - last_played, 0) / 86400
+            recency = 10 / (1 + days / 30)
+        return play_count + rating + recency
+
+    def rank_library(self, caps: dict) -> dict:
+        """
+        Selects the most played names per table in one streaming pass over all tracks.
+        Titles are selected with a bounded heap; artists, albums and genres sum up the scores
+        of their tracks, so memory is bounded by the number of distinct names.
+        :param caps: dictionary with table name ('titles', 'artists', 'albums', 'genres') and maximum count
+        :return: dictionary with table name and set of selected names, or None if no track has any statistics
+        """
+        title_heap = list()
+        titles_in_heap = set()
+        title_cap = caps.get('titles')
+        scores = {table_name: dict() for table_name in ['artists', 'albums', 'genres'] if caps.get(table_name)}
+        fields = [('artists', 'artist', 'artists'), ('albums', 'album', None), ('genres', 'genre', 'genres')]
+        has_statistics = False
+
+        for track_dict in self.server.request_pages("titles", "titles_loop", ["tags:aglR" + self.statistics_tags]):
+            score = self.play_score(track_dict)
+            has_statistics = has_statistics or score > 0
+            title = track_dict.get('title')
+            if title_cap and title and title not in titles_in_heap:
+                if len(title_heap) < title_cap:
+                    heapq.heappush(title_heap, (score, title))
+                    titles_in_heap.add(title)
+                elif score > title_heap[0][0]:
+                    _, removed = heapq.heapreplace(title_heap, (score, title))
+                    titles_in_heap.discard(removed)
+                    titles_in_heap.add(title)
+            for table_name, key, split_entity in fields:
+                value = track_dict.get(key)
+                if table_name not in scores or not value:
+                    continue
+                table_scores = scores[table_name]
+                for name in (self.normaliser.split(split_entity, value) if split_entity else [value]):
+                    table_scores[name] = table_scores.get(name, 0) + score
+
+        if not has_statistics:
+            # Without any statistics the caps would keep whichever names come first
+            print("No play statistics on the server, the vocabulary is not capped")
+            return None
+        ranking = {table_name: set(heapq.nlargest(caps[table_name], table_scores, key=table_scores.get))
+                   for table_name, table_scores in scores.items()}
+        if title_cap:
+            ranking['titles'] = titles_in_heap
+        return ranking
+
+    def get_library(self, refresh=False) -> lmscatalog.LibrarySnapshot:
+        """
+        Returns the shared library snapshot. It is only rebuilt if it is refreshed and the catalog changed,
+        so intents can use it without any requests to LMS.
+        :param refresh: Whether the catalog should be checked for changes
+        :return: LibrarySnapshot object
+        """
+        if self.library and not refresh:
+            return self.library
+        catalog = self.get_catalog()
+        if not self.library or self.library.key != catalog.key:
+            self.library = lmscatalog.LibrarySnapshot.from_catalog(catalog)
+            self.build_fuzzy_indexes(catalog)
+            self.build_genre_index(catalog)
+        return self.library
+
+    def get_inject_operations(self, requested_type: str, full_reset: bool = False) -> (str, list, dict):
+        """
+        Returns a list with operation dictionaries for the snips-injection service.
+        Entities which only got new names since the last confirmed injection are sent as
+        incremental 'add' operations, all others are reloaded with 'addFromVanilla'.
         :param requested_type: a special type of injection slots if requested in speech command
-        :return: error if there is one, list with operations
+        :param full_reset: whether all entities should be reloaded with 'addFromVanilla'
+        :return: error if there is one, list with operations, injected vocabulary per entity
         """
         if not self.server.connected():
             err = "Die Namen konnten nicht gesammelt werden. Es besteht keine Verbindung zum Medien Server."
-            return err, None
+            return err, None, None
 
         if requested_type:
             if requested_type == "music":
@@ -84,151 +737,434 @@ class LMSController:
             requested_types = ["device", "room", "area", "album", "artist",
                                "title", "playlist", "genre", "radio", "podcast"]
 
-        operations = list()
-        if "title" in requested_types:
-            titles = self.get_music_titles()
-            if titles:
-                operations.append(('addFromVanilla', {'squeezebox_titles': titles}))
-        if "artist" in requested_types:
-            artists = self.get_music_artists()
-            if artists:
-                operations.append(('addFromVanilla', {'squeezebox_artists': artists}))
-        if "album" in requested_types:
-            albums = self.get_music_albums()
-            if albums:
-                operations.append(('addFromVanilla', {'squeezebox_albums': albums}))
-        if "genre" in requested_types:
-            genres = self.get_music_genres()
-            if genres:
-                operations.append(('addFromVanilla', {'squeezebox_genres': genres}))
-        if "playlist" in requested_types:
-            playlists = self.get_music_playlists()
-            if playlists:
-                operations.append(('addFromVanilla', {'squeezebox_playlists': playlists}))
+        # Fetch plan: every source is fetched once and independent sources in parallel.
+        # Radios and podcasts are derived from the favorites and the library catalog.
+        entities = [("title", 'titles', 'squeezebox_titles'),
+                    ("artist", 'artists', 'squeezebox_artists'),
+                    ("album", 'albums', 'squeezebox_albums'),
+                    ("genre", 'genres', 'squeezebox_genres'),
+                    ("playlist", 'playlists', 'squeezebox_playlists')]
+        caps = {table_name: self.vocabulary_caps[table_name] for info_type, table_name, _ in entities
+                if info_type in requested_types and table_name in self.vocabulary_caps}
+        fetchers = dict()
+        if {"title", "artist", "album", "genre", "playlist", "radio", "podcast"} & set(requested_types):
+            fetchers['library'] = lambda: self.get_library(refresh=True)
+        if {"radio", "podcast"} & set(requested_types) or caps:
+            fetchers['favorites'] = self.get_favorites
+        if caps:
+            fetchers['ranking'] = lambda: self.call_offloaded('rank_library', caps)
+        sources = self.fetch_concurrently(fetchers)
+        if {"radio", "podcast"} & set(requested_types):
+            self.search_cache.invalidate()
+        catalog = self.catalog
+        library = sources.get('library')
+
+        vocabulary = dict()
+        for info_type, table_name, entity_name in entities:
+            if info_type in requested_types:
+                vocabulary[entity_name] = catalog.originals(table_name)
+                if table_name in caps and sources['ranking'] is not None:
+                    # Favorites are always kept, even if they are rarely played
+                    allowed = sources['ranking'][table_name] | {f['name'] for f in sources['favorites']}
+                    vocabulary[entity_name] = [name for name in vocabulary[entity_name] if name in allowed]
+        if 'favorites' in sources:
+            self.build_favorites_index(sources['favorites'], library or self.get_library())
         if "radio" in requested_types:
-            radios = self.get_radio_stations()
-            if radios:
-                operations.append(('addFromVanilla', {'squeezebox_radios': radios}))
+            vocabulary['squeezebox_radios'] = self.get_radio_stations(sources['favorites'], library)
         if "podcast" in requested_types:
-            podcasts = self.get_podcast_titles()
-            if podcasts:
-                operations.append(('addFromVanilla', {'squeezebox_podcasts': podcasts}))
+            vocabulary['squeezebox_podcasts'] = self.get_podcast_titles(sources['favorites'], library)
         if "device" in requested_types:
             devices = self.get_site_names('devices')
             nosite_devices = self.nosite_players_dict
             for d in nosite_devices.keys():
                 if d not in devices:
                     devices.append(d)
-            if devices:
-                operations.append(('addFromVanilla', {'audio_devices': devices}))
+            vocabulary['audio_devices'] = devices
         if "rooms" in requested_types:
-            rooms = self.get_site_names('rooms')
-            if rooms:
-                operations.append(('addFromVanilla', {'squeezebox_rooms': rooms}))
+            vocabulary['squeezebox_rooms'] = self.get_site_names('rooms')
         if "area" in requested_types:
-            areas = self.get_site_names('areas')
-            if areas:
-                operations.append(('addFromVanilla', {'squeezebox_areas': areas}))
+            vocabulary['squeezebox_areas'] = self.get_site_names('areas')
+        vocabulary = {entity_name: names for entity_name, names in vocabulary.items() if names}
+
+        operations = list()
+        for entity_name, names in vocabulary.items():
+            injected = self.injected_vocabulary.get(entity_name)
+            if full_reset or injected is None or not injected.issubset(names):
+                operations.append(('addFromVanilla', {entity_name: names}))
+            else:
+                added = [name for name in names if name not in injected]
+                if added:
+                    operations.append(('add', {entity_name: added}))
 
         if not operations:
-            return "Es gibt nichts hinzuzufügen.", None
+            return "Es gibt nichts hinzuzufügen.", None, None
         else:
-            return None, operations
+            return None, operations, vocabulary
+
+    def start_injection(self, operations: list, vocabulary: dict, site_id: str,
+                        on_finished: Callable = None, on_failed: Callable = None) -> InjectionJob:
+        """
+        Publishes the operations in size-bounded chunks. Only a few chunks are in flight at the same
+        time, the next ones are published when the injection service completes the previous ones.
+        :param operations: Operations from get_inject_operations
+        :param vocabulary: Vocabulary from get_inject_operations
+        :param site_id: siteId which requested the injection
+        :param on_finished: Called with the job after all chunks are completed
+        :param on_failed: Called with the job if a chunk failed after all retries
+        :return: injection job
+        """
+        job = InjectionJob(site_id, vocabulary, split_operations(operations, self.injection_chunk_bytes),
+                           on_finished, on_failed)
+        with self.injection_lock:
+            for request_id in job.request_ids:
+                self.injection_jobs[request_id] = job
+            self.publish_next_chunks(job)
+        return job
+
+    def publish_next_chunks(self, job: InjectionJob):
+        """
+        Publishes the waiting chunks in order. A chunk which resets an entity ('addFromVanilla') is the
+        only chunk in flight until it is completed, so it cannot wipe the names of later chunks.
+        """
+        for index, state in enumerate(job.states):
+            in_flight = job.in_flight
+            if len(in_flight) >= self.injection_window or any(job.vanilla_entities(i) for i in in_flight):
+                return
+            if state == 'waiting':
+                if in_flight and job.vanilla_entities(index):
+                    return
+                self.publish_chunk(job, index)
+
+    def publish_chunk(self, job: InjectionJob, index: int):
+        job.states[index] = 'in_flight'
+        job.tries[index] += 1
+        request_id = job.request_ids[index]
+        payload = {'id': request_id, 'operations': job.chunks[index]}
+        self.mqtt_client.publish('hermes/injection/perform', json.dumps(payload))
+        timer = threading.Timer(self.injection_timeout, self.check_chunk, (job, index, request_id))
+        timer.daemon = True
+        timer.start()
+
+    def renew_request_id(self, job: InjectionJob, index: int):
+        """
+        Gives a chunk a new request id, so late answers to its earlier request are ignored.
+        """
+        self.injection_jobs.pop(job.request_ids[index], None)
+        job.request_ids[index] = str(uuid.uuid4())
+        self.injection_jobs[job.request_ids[index]] = job
+
+    def check_chunk(self, job: InjectionJob, index: int, request_id: str):
+        """
+        Called after the timeout of a published chunk. Publishes the chunk again if it is
+        still not completed or marks the whole job as failed after all retries.
+        If a chunk which resets an entity is published again, the later chunks of that entity are
+        published again after it, because the repeated reset wipes their names.
+        """
+        with self.injection_lock:
+            if job.failed or job.states[index] != 'in_flight' or job.request_ids[index] != request_id:
+                return
+            if job.tries[index] <= self.injection_retries:
+                print(f"Injection chunk {index + 1}/{len(job.chunks)} timed out: retry {job.tries[index]}")
+                self.renew_request_id(job, index)
+                reset_entities = job.vanilla_entities(index)
+                for later in range(index + 1, len(job.chunks)):
+                    if job.states[later] != 'waiting' and reset_entities & job.entities(later):
+                        job.states[later] = 'waiting'
+                        job.tries[later] = 0
+                        self.renew_request_id(job, later)
+                self.publish_chunk(job, index)
+                return
+            job.failed = True
+            self.forget_injection(job)
+            # Some entities may have been reset, so the next injection has to load them completely
+            for entity_name in job.vocabulary:
+                self.injected_vocabulary.pop(entity_name, None)
+        if job.on_failed:
+            job.on_failed(job)
+
+    def forget_injection(self, job: InjectionJob):
+        for request_id in job.request_ids:
+            self.injection_jobs.pop(request_id, None)
+
+    def injection_completed(self, request_id: str):
+        """
+        Marks one chunk as completed. After the last chunk the vocabulary of the job is
+        remembered as the base for the next incremental injection.
+        :param request_id: Id of the injection request
+        """
+        with self.injection_lock:
+            job = self.injection_jobs.get(request_id)
+            if not job or job.failed:
+                return
+            index = job.request_ids.index(request_id)
+            if job.states[index] != 'in_flight':
+                return
+            job.states[index] = 'completed'
+            print(f"Injection progress: {job.states.count('completed')}/{len(job.chunks)} chunks")
+            if not job.finished:
+                self.publish_next_chunks(job)
+                return
+            self.forget_injection(job)
+            for entity_name, names in job.vocabulary.items():
+                self.injected_vocabulary[entity_name] = frozenset(names)
+        if job.on_finished:
+            job.on_finished(job)
+
+    def iter_library_names(self, command: str, loop_name: str, key: str, split_entity: str = None,
+                           tagged_params: list = None):
+        """
+        Yields the unique names of a library listing. The listing is fetched page by page,
+        so only one page of the server response is held in memory.
+        :param command: LMS listing command, e.g. "albums"
+        :param loop_name: Name of the result loop, e.g. "albums_loop"
+        :param key: Key of the name in each item dictionary, e.g. "album"
+        :param split_entity: Entity name of the normaliser split pattern to split one name into several
+        :param tagged_params: Tagged parameters for the listing command
+        :return: generator of unique names
+        """
+        seen = set()
+        for item_dict in self.server.request_pages(command, loop_name, tagged_params):
+            value = item_dict.get(key)
+            if not value:
+                continue
+            for name in (self.normaliser.split(split_entity, value) if split_entity else [value]):
+                if name and name not in seen:
+                    seen.add(name)
+                    yield name
+
+    def iter_music_albums(self):
+        return self.iter_library_names("albums", "albums_loop", "album", tagged_params=["tags:l"])
+
+    def iter_music_titles(self):
+        return self.iter_library_names("titles", "titles_loop", "title", tagged_params=["tags:e"])
+
+    def iter_music_artists(self):
+        return self.iter_library_names("artists", "artists_loop", "artist", split_entity='artists')
+
+    def iter_music_genres(self):
+        return self.iter_library_names("genres", "genres_loop", "genre", split_entity='genres')
+
+    def iter_music_playlists(self):
+        return self.iter_library_names("playlists", "playlists_loop", "playlist")
 
     def get_music_albums(self) -> list:
-        all_albums = list()
-        albums = self.server.request(params="albums list")
-        if albums.get('count') >= 1:
-            for album_dict in albums.get('albums_loop'):
-                album = album_dict['album']
-                if album not in all_albums:
-                    all_albums.append(album)
-        return all_albums
+        return list(self.iter_music_albums())
 
     def get_music_titles(self) -> list:
-        all_titles = list()
-        titles = self.server.request(params="titles list")
-        if titles.get('count') >= 1:
-            for title_dict in titles.get('titles_loop'):
-                title = title_dict['title']
-                if title not in all_titles:
-                    all_titles.append(title)
-        return all_titles
+        return list(self.iter_music_titles())
 
     def get_music_artists(self) -> list:
-        all_artists = list()
-        artists = self.server.request(params="artists list")
-        if artists.get('count') >= 1:
-            for artist_dict in artists.get('artists_loop'):
-                for artist in re.split(r'; |;|, |,', artist_dict['artist']):
-                    if artist and artist not in all_artists:
-                        all_artists.append(artist)
-        return all_artists
+        return list(self.iter_music_artists())
 
     def get_music_genres(self) -> list:
-        all_genres = list()
-        genres = self.server.request(params="genres list")
-        if genres.get('count') >= 1:
-            for genre_dict in genres.get('genres_loop'):
-                for genre in re.split(r'; |;|, |,|/| / ', genre_dict['genre']):
-                    if genre and genre not in all_genres:
-                        all_genres.append(genre)
-        return all_genres
+        return list(self.iter_music_genres())
 
     def get_music_playlists(self) -> list:
-        all_playlists = list()
-        playlists = self.server.request(params="playlists list")
-        if playlists.get('count') >= 1:
-            for playlist_dict in playlists.get('playlists_loop'):
-                playlist = playlist_dict['playlist']
-                if playlist not in all_playlists:
-                    all_playlists.append(playlist)
-        return all_playlists
-
-    def get_radio_stations(self) -> list:
+        return list(self.iter_music_playlists())
+
+    def get_favorites(self, folder_id: str = None, max_depth: int = 5, visited: set = None) -> list:
+        """
+        Returns all favorites including the ones in nested folders. Folders have subitems
+        but no url; feeds like podcasts have subitems and a url.
+        :param folder_id: Id of the folder whose favorites are returned; the top level if not given
+        :param max_depth: Number of folder levels below this folder which are still browsed
+        :param visited: Ids of the folders which were already browsed; every folder is browsed only once
+        """
+        visited = set() if visited is None else visited
+        tagged_params = ["want_url:1"]
+        if folder_id:
+            tagged_params.append(f"item_id:{folder_id}")
+            visited.add(folder_id)
+        favorite_dicts = list()
+        for favorite_dict in self.server.request_pages("favorites items", "loop_loop", tagged_params):
+            if favorite_dict.get('hasitems') and not favorite_dict.get('url') and not favorite_dict.get('isaudio'):
+                if max_depth > 0 and favorite_dict['id'] not in visited:
+                    favorite_dicts.extend(self.get_favorites(favorite_dict['id'], max_depth - 1, visited))
+            else:
+                favorite_dicts.append(favorite_dict)
+        return favorite_dicts
+
+    def build_favorites_index(self, favorite_dicts: list, library: lmscatalog.LibrarySnapshot) -> dict:
+        """
+        Maps the canonical names of favorite radio stations and podcasts to their favorite.
+        :param favorite_dicts: Favorites as returned by get_favorites
+        :param library: Library snapshot to tell podcasts from albums and artists
+        :return: dictionary with canonical name and dictionary with id, name and type ('radio' or 'podcast')
+        """
+        favorites_index = dict()
+        for favorite_dict in favorite_dicts:
+            name = favorite_dict['name']
+            if favorite_dict.get('isaudio') and not library.has_title(name):
+                favorite_type = "radio"
+            elif self.is_podcast(favorite_dict, library):
+                favorite_type = "podcast"
+            else:
+                continue
+            favorites_index.setdefault(self.normaliser.canonical(name),
+                                       {'id': favorite_dict['id'], 'name': name, 'type': favorite_type,
+                                        'url': favorite_dict.get('url')})
+        with self.favorites_lock:
+            self.favorites_index = favorites_index
+            self.favorites_index_expiry = time.monotonic() + self.favorites_ttl
+        return favorites_index
+
+    def get_favorites_index(self) -> dict:
+        """
+        Returns the favorites index. It is rebuilt after favorites changed or, without change
+        notifications from LMS, after the time-to-live expired.
+        """
+        with self.favorites_lock:
+            if self.favorites_index is not None and time.monotonic() < self.favorites_index_expiry:
+                return self.favorites_index
+        return self.build_favorites_index(self.get_favorites(), self.get_library())
+
+    def find_favorite(self, name: str, favorite_type: str):
+        """
+        :return: favorite dictionary with id, name and type or None
+        """
+        favorite = self.get_favorites_index().get(self.normaliser.canonical(name))
+        if favorite and favorite['type'] == favorite_type:
+            return favorite
+        return None
+
+    def favorites_changed(self, event=None):
+        with self.favorites_lock:
+            self.favorites_index = None
+        if self.episode_prefetcher:
+            self.episode_prefetcher.resync()
+
+    def fetch_favorite_episodes(self, podcast_id: str, player=None):
+        """
+        Browses the episodes of a favorite podcast. LMS fetches and parses the feed for this.
+        :param podcast_id: Favorite id of the podcast
+        :param player: LMSPlayer which sends the request; a server level request if not given
+        :return: list of audio episode dictionaries or None if the podcast has no episodes
+        """
+        command = f"favorites items 0 30 item_id:{podcast_id}.0"
+        result = player.request(command) if player else self.server.request(params=command)
+        if not result or not result.get('count'):
+            return None
+        return [item_dict for item_dict in result.get('loop_loop', list()) if item_dict.get('isaudio')]
+
+    def start_episode_prefetch(self, interval=900, max_interval=21600):
+        """
+        Starts to pre-load the episode lists of all favorite podcasts in the background,
+        so podcast requests are answered from memory.
+        :param interval: Normal refresh interval of a podcast in seconds
+        :param max_interval: Longest refresh interval of an unchanged podcast in seconds
+        """
+        def list_podcasts():
+            return [favorite for favorite in self.get_favorites_index().values() if favorite['type'] == "podcast"]
+
+        self.episode_prefetcher = lmsprefetch.EpisodePrefetcher(list_podcasts, self.fetch_favorite_episodes,
+                                                                interval, max_interval)
+        self.episode_prefetcher.start()
+
+    def load_library(self):
+        """
+        Loads the library catalog if it was not loaded yet. Without catalog, music is searched by text.
+        :return: LibrarySnapshot object or None if the catalog could not be loaded
+        """
+        try:
+            return self.get_library()
+        except Exception as e:
+            print(f"Library catalog could not be loaded: {e!r}")
+            return None
+
+    def start_library_preload(self):
+        """
+        Loads the library catalog in the background after a start, so the first music request can
+        already use the catalog ids and the fuzzy index.
+        """
+        threading.Thread(target=self.load_library, daemon=True).start()
+
+    def start_favorites_listener(self, cli_port: int = 9090):
+        """
+        Listens to the favorites change notifications on the command line interface of LMS,
+        so the favorites index is rebuilt on the next request after favorites changed.
+        :param cli_port: Port of the command line interface
+        """
+        try:
+            from LMSTools.callbackserver import LMSCallbackServer
+        except ImportError:
+            print("Favorites change notifications are not available: falling back to the time-to-live")
+            return
+        lms_host, _, lms_username, lms_password = self.server_args
+        self.favorites_listener = LMSCallbackServer(lms_host, cli_port, lms_username or "", lms_password or "")
+        self.favorites_listener.add_callback(LMSCallbackServer.FAVORITES_CHANGED, self.favorites_changed)
+        self.favorites_listener.start()
+
+    def get_radio_stations(self, favorite_dicts: list = None, library=None) -> list:
+        """
+        Returns the names of favorite audio streams which are not titles of the library.
+        :param favorite_dicts: Already fetched favorites; fetched if not given
+        :param library: Library snapshot; the shared one if not given
+        """
         all_radios = list()
-        count = self.server.request(params="favorites items").get('count')
-        if count:
-            favorite_dicts = self.server.request(params=f"favorites items 0 {count}")['loop_loop']
-            music_titles = self.get_music_titles()
+        if favorite_dicts is None:
+            favorite_dicts = self.get_favorites()
+        if favorite_dicts:
+            library = library or self.get_library()
             for favorite_dict in favorite_dicts:
                 name = favorite_dict['name']
-                if name not in all_radios and favorite_dict['isaudio'] and name not in music_titles:
+                if name not in all_radios and favorite_dict['isaudio'] and not library.has_title(name):
                     all_radios.append(name)
         return all_radios
 
-    def get_podcast_titles(self) -> list:
+    @staticmethod
+    def is_podcast(favorite_dict: dict, library: lmscatalog.LibrarySnapshot) -> bool:
+        name = favorite_dict['name']
+        return bool(favorite_dict['hasitems']) and not library.has_album(name) and not library.has_artist(name)
+
+    def get_podcast_titles(self, favorite_dicts: list = None, library=None) -> list:
+        """
+        Returns the names of favorite feeds which are neither albums nor artists of the library.
+        :param favorite_dicts: Already fetched favorites; fetched if not given
+        :param library: Library snapshot; the shared one if not given
+        """
         all_podcasts = list()
-        count = self.server.request(params="favorites items").get('count')
-        if count:
-            favorite_dicts = self.server.request(params=f"favorites items 0 {count}")['loop_loop']
-            music_albums = self.get_music_albums()
-            music_artists = self.get_music_artists()
+        if favorite_dicts is None:
+            favorite_dicts = self.get_favorites()
+        if favorite_dicts:
+            library = library or self.get_library()
             for favorite_dict in favorite_dicts:
                 name = favorite_dict['name']
-                if name not in all_podcasts and favorite_dict['hasitems'] \
-                        and name not in music_albums and name not in music_artists:
+                if name not in all_podcasts and self.is_podcast(favorite_dict, library):
                     all_podcasts.append(name)
         return all_podcasts
 
+    @property
+    def sites_dict(self) -> dict:
+        """
+        Sites of the current topology snapshot. The dictionary must not be changed.
+        """
+        return self.topology.sites
+
+    def update_site(self, data):
+        """
+        Creates or updates a site from a siteInfo message. The site and the indexes are changed on
+        copies, which are published as a new topology snapshot.
+        :param data: Data of the siteInfo message
+        """
+        with self.topology_lock:
+            topology = self.topology
+            old_site = topology.sites.get(data['site_id'])
+            site = old_site.copy() if old_site else Site(self.state_store.site(data['site_id']))
+            indexes = topology.indexes.copy()
+            site.update(data, self.server, indexes, self.state_store)
+            sites = dict(topology.sites)
+            sites[site.site_id] = site
+            self.topology = Topology(sites, indexes)
+
     def get_site_names(self, info_type: str) -> list:
-        all_names = list()
+        indexes = self.topology.indexes
         if info_type == "devices":
-            for site_id in self.sites_dict:
-                for device_name in self.sites_dict[site_id].devices_dict:
-                    device = self.sites_dict[site_id].devices_dict[device_name]
-                    for name in device.names_list:
-                        if name not in all_names:
-                            all_names.append(name)
+            return list(indexes.device_names)
         elif info_type == "areas":
-            for site_id in self.sites_dict:
-                if self.sites_dict[site_id].area not in all_names:
-                    all_names.append(self.sites_dict[site_id].area)
+            return list(indexes.areas)
         elif info_type == "rooms":
-            for site_id in self.sites_dict:
-                if self.sites_dict[site_id].room_name not in all_names:
-                    all_names.append(self.sites_dict[site_id].room_name)
-        return all_names
+            return list(indexes.rooms)
+        return list()
 
     def get_sites(self, request_siteid, slot_dict=None, single=False, room_slot='room'):
         """
@@ -239,20 +1175,21 @@ class LMSController:
         :param room_slot: Name for the room slot; useful for sync intent where room slot has names like 'master'
         :return: error, list of filtered site objects
         """
+        topology = self.topology
+        sites_dict = topology.sites
         if not slot_dict or not slot_dict.get(room_slot):
             room_slot_value = "hier"
         else:
             room_slot_value = slot_dict.get(room_slot)
 
-        if room_slot_value == "hier" and self.sites_dict.get(request_siteid):
-            sites = [self.sites_dict[request_siteid]]
-        elif room_slot_value == "hier" and not self.sites_dict.get(request_siteid):
+        if room_slot_value == "hier" and sites_dict.get(request_siteid):
+            sites = [sites_dict[request_siteid]]
+        elif room_slot_value == "hier" and not sites_dict.get(request_siteid):
             sites = []
         elif room_slot_value == "alle":
-            sites = [self.sites_dict[siteid] for siteid in self.sites_dict]
+            sites = list(sites_dict.values())
         else:
-            sites = [self.sites_dict[siteid] for siteid in self.sites_dict
-                     if self.sites_dict[siteid].room_name == room_slot_value]
+            sites = list(topology.indexes.rooms.get(room_slot_value, dict()).values())
 
         if not sites and room_slot_value == "alle":
             return "Es wurden noch keine Räume konfiguriert.", None
@@ -266,17 +1203,16 @@ class LMSController:
         else:
             area_slot_value = slot_dict.get('area')
 
-        if area_slot_value == "in diesem Bereich" and self.sites_dict.get(request_siteid):
-            sites = [site for site in sites if site.area == self.sites_dict[request_siteid].area]
-        elif area_slot_value == "in diesem Bereich" and not self.sites_dict.get(request_siteid):
+        if area_slot_value == "in diesem Bereich" and sites_dict.get(request_siteid):
+            sites = [site for site in sites if site.area == sites_dict[request_siteid].area]
+        elif area_slot_value == "in diesem Bereich" and not sites_dict.get(request_siteid):
             return "Der Raum hier wurde noch nicht konfiguriert.", None
         elif area_slot_value == "in allen Bereichen" and not slot_dict.get(room_slot):
-            sites = [self.sites_dict[siteid] for siteid in self.sites_dict]
+            sites = list(sites_dict.values())
         elif not slot_dict.get(room_slot):
-            sites = [self.sites_dict[siteid] for siteid in self.sites_dict
-                     if self.sites_dict[siteid].area == area_slot_value]
+            sites = list(topology.indexes.areas.get(area_slot_value, dict()).values())
         else:
-            sites = [site for site in sites if site.area == self.sites_dict[site.site_id].area]
+            sites = [site for site in sites if site.area == sites_dict[site.site_id].area]
         if not sites:
             return "Diese Auswahl an Räumen existiert nicht.", None
         return None, sites
@@ -290,11 +1226,9 @@ class LMSController:
         """
         if self.server.connected:
             players_dict = {player.ref: player for player in self.server.get_players() if player.connected}
-            for site_id in self.sites_dict:
-                site = self.sites_dict[site_id]
-                for device_mac in site.devices_dict:
-                    device = site.devices_dict[device_mac]
-                    if not device.on_the_fly and device.player.ref in players_dict:
+            for site in self.sites_dict.values():
+                for device in site.devices_dict.values():
+                    if device.player.ref in players_dict:
                         del players_dict[device.player.ref]
             players = {players_dict[ref].name: players_dict[ref] for ref in players_dict}
         else:
@@ -306,7 +1240,9 @@ class LMSController:
                            sites: list = None):
         """
         Prepare devices for playing. Connect bluetooth devices and start squeezelite
-        if necessary with queues. Then call the target function if given.
+        if necessary. Then call the target function if given.
+        The request waits as PendingAction for the answers, so several requests can be in flight at once.
+        Each device runs through its own steps, independent of the other devices.
         :param slots: Slot dictionary from Snips
         :param request_siteid: siteId of the request site from Snips
         :param target: Target function which should be called after successfull setup
@@ -326,16 +1262,15 @@ class LMSController:
             if err:
                 return err
 
-        if not request_site.action_target:
-            request_site.need_connection_queue = list()
-            request_site.need_service_queue = list()
-
-            if sites:
-                nosite_players = self.nosite_players_dict
-                for site in sites:
-                    if site.active_device and not slots.get('device'):
+        action = PendingAction(request_siteid, slots, target, args)
+        if sites:
+            nosite_players = self.nosite_players_dict
+            for site in sites:
+                with self.state_store.lock:
+                    previous_device = site.active_device
+                    if previous_device and not slots.get('device'):
                         # device is the current active device of site if there is any and slot is filled
-                        device = site.active_device
+                        device = previous_device
                     else:
                         if slots.get('device') == "alle":
                             return "Es geht nur ein Gerät pro Raum."
@@ -343,9 +1278,8 @@ class LMSController:
                             device_slot_value = slots['device']
                         else:
                             device_slot_value = site.default_device_name
-                        found = [site.devices_dict[mac] for mac in site.devices_dict
-                                 if device_slot_value in site.devices_dict[mac].names_list]
-                        if not found:
+                        device = site.find_device(device_slot_value)
+                        if not device:
                             player = nosite_players.get(device_slot_value)
                             if player:
                                 # If LMSplayer with this name exists, add on-the-fly device to site
@@ -353,102 +1287,163 @@ class LMSController:
                                 device = Device(player)
                                 device.site_id = site.site_id
                                 device.on_the_fly = True
-                                site.devices_dict[player.ref] = device
+                                site.state.on_the_fly_devices[player.ref] = device
                             else:
                                 return f"Dieses Gerät gibt es im Raum {site.room_name} nicht."
-                        else:
-                            device = found[0]
 
-                        if site.active_device and site.active_device != device:
-                            site.active_device.player.pause()
-                            site.active_device.auto_pause = False
+                if previous_device and previous_device != device:
+                    previous_device.player.pause()
+                    previous_device.auto_pause = False
 
-                    # Check bluetooth connection if device is bluetooth device
-                    if device.bluetooth and not device.bluetooth['is_connected']:
-                        request_site.need_connection_queue.append(device)
+                # Check bluetooth connection if device is bluetooth device
+                if device.bluetooth and not device.bluetooth_connected:
+                    action.need_connection[str(uuid.uuid4())] = device
 
-                    # Check LMSplayer connection
-                    if device.player.connected:
-                        # Set active device of site to that device
-                        site.active_device = device
+                # Check LMSplayer connection
+                if device.player.connected:
+                    # Set active device of site to that device
+                    site.active_device = device
+                else:
+                    if device.soundcard:
+                        # If device has ALSA soundcard, it needs a squeezelite start
+                        # The active device of site will be set after connecting successfully
+                        action.need_service[str(uuid.uuid4())] = device
                     else:
-                        if device.soundcard:
-                            # If device has ALSA soundcard, append it to the squeezelite_start queue
-                            # The active device of site will be set after connecting successfully
-                            request_site.need_service_queue.append(device)
-                        else:
-                            if device.on_the_fly:
-                                # Delete disconnected on-the-fly LMSplayer and its device from site
-                                del site.devices_dict[device.player.ref]
+                        if device.on_the_fly:
+                            # Delete disconnected on-the-fly LMSplayer and its device from site
+                            with self.state_store.lock:
+                                site.state.on_the_fly_devices.pop(device.player.ref, None)
                                 site.active_device = None
-                                if len(sites) > 1:
-                                    continue
-                            return f"Das Gerät {device.name} ist nicht mit dem Medienserver verbunden."
-
-            # Set action target function which will be called if bluetooth
-            # connection queue and squeezelite_start queue are empty
-            request_site.action_target = target
-            request_site.action_target_args = args
-
-        if request_site.need_connection_queue:
-            for device in request_site.need_connection_queue:
-                site = self.sites_dict[device.site_id]
-                site.pending_action = {
-                    'slot_dict': slots,
-                    'request_siteid': request_siteid,
-                    'device': device,
-                }
-                payload = {  # information for bluetooth connection
-                    'addr': device.bluetooth['addr'],
-                    'tries': 3
-                }
-                self.mqtt_client.publish(  # request bluetooth connection
-                    f'bluetooth/request/oneSite/{site.site_id}/deviceConnect',
-                    json.dumps(payload)
-                )
-            return None
+                            if len(sites) > 1:
+                                continue
+                        return f"Das Gerät {device.name} ist nicht mit dem Medienserver verbunden."
 
-        if request_site.need_service_queue:
-            for device in request_site.need_service_queue:
-                site = self.sites_dict[device.site_id]
-
-                site.pending_action = {
-                    'slot_dict': slots,
-                    'request_siteid': request_siteid,
-                    'device': device
-                }
-
-                client_name = site.room_name
-                areas = list()
-                for site_id in self.sites_dict:
-                    area = self.sites_dict[site_id].area
-                    if area not in areas:
-                        areas.append(area)
-                if len(areas) > 1:
-                    client_name += f"-{site.area}"
-                if device.synonyms:
-                    client_name += f"-{device.synonyms[0]}"
+        return self.continue_action(action)
+
+    def continue_action(self, action):
+        """
+        Sends the requests of all steps of a pending action whose prerequisites are met, so every device
+        moves on to its squeezelite start as soon as its own bluetooth connection is established.
+        Calls the target if all devices are ready.
+        Every request carries the correlation id of its step as 'request_id', which is echoed in the answer.
+        :param action: PendingAction object
+        :return: errors or result as str
+        """
+        with self.pending_lock:
+            steps = action.ready_steps()
+            for correlation_id, device, phase in steps:
+                action.started.add(correlation_id)
+                self.pending_actions[correlation_id] = action
+            ready = not action.need_connection and not action.need_service and not action.finished
+            if ready:
+                action.finished = True
+
+        for correlation_id, device, phase in steps:
+            if phase == 'need_connection':
+                self.request_connection(correlation_id, device)
+            else:
+                self.request_service(correlation_id, device)
+
+        if ready and action.target:  # Call target function after all devices are ready
+            print("All devices are ready: next step")
+            return action.target(*action.args)
+
+    def request_connection(self, correlation_id: str, device: Device):
+        payload = {  # information for bluetooth connection
+            'addr': device.bluetooth['addr'],
+            'tries': 3,
+            'request_id': correlation_id,
+        }
+        self.mqtt_client.publish(  # request bluetooth connection
+            f'bluetooth/request/oneSite/{device.site_id}/deviceConnect',
+            json.dumps(payload)
+        )
+
+    def request_service(self, correlation_id: str, device: Device):
+        site = self.sites_dict[device.site_id]
+        client_name = site.room_name
+        if len(self.topology.indexes.areas) > 1:
+            client_name += f"-{site.area}"
+        if device.synonyms:
+            client_name += f"-{device.synonyms[0]}"
+        else:
+            client_name += f"-{device.name}"
+
+        payload = {  # information for squeezelite service
+            'server': self.server.host,
+            'squeeze_mac': device.player.ref,
+            'soundcard': device.soundcard,
+            'player_name': client_name,
+            'device_name': device.name,
+            'request_id': correlation_id,
+        }
+        self.mqtt_client.publish(
+            f'squeezebox/request/oneSite/{site.site_id}/serviceStart',
+            json.dumps(payload)
+        )
+
+    def take_pending_step(self, data: dict, phase: str):
+        """
+        Removes the step of an answer from the pending action table.
+        Answers without correlation id are matched by the site (and bluetooth address) of the device.
+        :param data: Data of the answer message
+        :param phase: 'need_connection' or 'need_service'
+        :return: PendingAction object and device or None, None
+        """
+        with self.pending_lock:
+            correlation_id = data.get('request_id')
+            action = self.pending_actions.pop(correlation_id, None) if correlation_id else None
+            if not action:
+                for correlation_id, pending_action in self.pending_actions.items():
+                    device = getattr(pending_action, phase).get(correlation_id)
+                    if device and device.site_id == data.get('siteId') and \
+                            data.get('addr', device.bluetooth.get('addr')) == device.bluetooth.get('addr'):
+                        action = self.pending_actions.pop(correlation_id)
+                        break
                 else:
-                    client_name += f"-{device.name}"
-
-                payload = {  # information for squeezelite service
-                    'server': self.server.host,
-                    'squeeze_mac': device.player.ref,
-                    'soundcard': device.soundcard,
-                    'player_name': client_name,
-                    'device_name': device.name,
-                }
-                self.mqtt_client.publish(
-                    f'squeezebox/request/oneSite/{site.site_id}/serviceStart',
-                    json.dumps(payload)
-                )
-            return None
+                    return None, None
+            device = getattr(action, phase).pop(correlation_id, None)
+        if device is None:
+            return None, None
+        return action, device
 
-        if request_site.action_target:  # Call target function after all queues
-            result = request_site.action_target(*request_site.action_target_args)
-            request_site.action_target = None
-            request_site.action_target_args = None
-            return result
+    def cancel_action(self, action):
+        with self.pending_lock:
+            for correlation_id in list(action.need_connection) + list(action.need_service):
+                self.pending_actions.pop(correlation_id, None)
+
+    def device_connected(self, data: dict):
+        """
+        Continues the pending action of a bluetooth connection answer.
+        :param data: Data of the deviceConnect answer
+        :return: siteId of the request, error or result as str
+        """
+        action, device = self.take_pending_step(data, 'need_connection')
+        if not action:
+            return None, None
+        device.bluetooth_connected = data['result']
+        if not data['result']:
+            self.cancel_action(action)
+            return action.request_siteid, None
+        return action.request_siteid, self.continue_action(action)
+
+    def service_started(self, data: dict):
+        """
+        Continues the pending action of a squeezelite start answer.
+        :param data: Data of the serviceStart answer
+        :return: siteId of the request, error or result as str
+        """
+        action, device = self.take_pending_step(data, 'need_service')
+        if not action:
+            return None, None
+        site = self.sites_dict.get(device.site_id)
+        if data['result'] and device.player.connected:
+            site.active_device = device
+            return action.request_siteid, self.continue_action(action)
+        self.cancel_action(action)
+        if data['result']:
+            return action.request_siteid, f"Das Abspielprogramm wurde im Raum {site.room_name} nicht richtig gestartet."
+        return action.request_siteid, f"Das Abspielprogramm konnte im Raum {site.room_name} nicht gestartet werden."
 
     def get_player_and_sync(self, slot_dict, request_siteid):
         """
@@ -479,95 +1474,190 @@ class LMSController:
             player = sites[0].active_device.player
         return None, player
 
-    def music(self, slot_dict, request_siteid):
+    def resolve_speculatively(self, intent: str, slot_dict: dict):
+        """
+        Starts the content resolution of an intent in the background, so it runs while the
+        devices are being prepared.
+        :param intent: 'music', 'podcast' or 'radio'
+        :param slot_dict: Slot dictionary from Snips
+        :return: Future with the result of resolve_<intent>
+        """
+        return self.resolver_pool.submit(getattr(self, f"resolve_{intent}"), slot_dict)
+
+    def play_content(self, slot_dict, request_siteid, resolve: Callable, resolution=None):
+        """
+        Plays resolved content on the player of the request.
+        :param slot_dict: Slot dictionary from Snips
+        :param request_siteid: siteId of the request site from Snips
+        :param resolve: resolve function which is called if the content was not resolved speculatively
+        :param resolution: Future of resolve_speculatively or None
+        :return: error or None
+        The slot 'queue_position' selects whether the playlist is replaced (not given), the content is
+        appended to it ('append') or inserted after the current track ('next').
+        """
         if not self.server.connected():
             return "Der Server ist nicht erreichbar."
+        err, plan = resolution.result() if resolution else resolve(slot_dict)
+        if err:
+            return err
         err, player = self.get_player_and_sync(slot_dict, request_siteid)
         if err:
             return err
 
+        items = plan['items']
+        replace_verb, add_verb, insert_verb = plan.get('verbs', ITEM_VERBS)
+        mode = slot_dict.get('queue_position')
+        if mode not in ["append", "next"] or not items or not player.track_count:
+            # Random mixes always replace the playlist and an empty playlist is simply filled
+            mode = None
+        if not mode:
+            first_item = [item.replace("{verb}", replace_verb) for item in items[:1]]
+            results = player.request_batch(plan['setup'] + first_item + ["playlist tracks ?"] * len(first_item))
+            if first_item and not int((results[-1] or dict()).get("_tracks") or 0):
+                # The first item replaces the playlist, so an empty playlist means that it failed
+                return "Das konnte nicht abgespielt werden."
+            commands = [item.replace("{verb}", add_verb) for item in items[1:]]
+            position = None
+        elif mode == "append":
+            commands = [item.replace("{verb}", add_verb) for item in items]
+            position = None
+        else:
+            # Every insert goes directly after the current track, so the items are inserted in reverse order
+            commands = [item.replace("{verb}", insert_verb) for item in reversed(items)]
+            position = player.playlist_position + 1
+        if commands:
+            # The playing track is not touched, so it is neither interrupted nor buffered again
+            # Items like whole albums add several tracks, so each command is checked on its own
+            added = player.playlist_enqueue(commands, position=position)
+            if not all(added):
+                return "Es konnte nicht alles in die Wiedergabeliste eingereiht werden."
+        return None
+
+    def resolve_music(self, slot_dict):
+        """
+        Resolves the music slots to the commands which play the music.
+        :param slot_dict: Slot dictionary from Snips
+        :return: error, plan with 'setup' commands, 'items' command templates and their 'verbs'
+        """
         query_params = list()
-        artist = slot_dict.get('artist')
-        album = slot_dict.get('album')
-        title = slot_dict.get('title')
+        if slot_dict.get('artist') or slot_dict.get('album') or slot_dict.get('title') or slot_dict.get('genre'):
+            # Loads the catalog if it was not loaded yet; afterwards this needs no request
+            self.load_library()
+        artist = self.resolve_slot('artists', slot_dict.get('artist'))
+        album = self.resolve_slot('albums', slot_dict.get('album'))
+        title = self.resolve_slot('titles', slot_dict.get('title'))
         genre = slot_dict.get('genre')
-        if album or title:
+        if genre and (album or title or artist):
+            genre = self.resolve_slot('genres', genre)
+        resolved_ids = self.resolve_music_ids(artist, album, title) if (artist or album or title) and not genre \
+            else None
+        if resolved_ids:
+            # Play the ids from the catalog, so LMS does not need to run a text search
+            id_name, ids = resolved_ids
+            shuffle = "playlist shuffle 0" if album or title else "playlist shuffle 1"
+            if id_name == 'track_id':
+                items = [f"playlistcontrol cmd:{{verb}} track_id:{','.join(str(i) for i in ids)}"]
+            else:
+                items = [f"playlistcontrol cmd:{{verb}} {id_name}:{i}" for i in ids]
+            return None, {'setup': [shuffle], 'items': items, 'verbs': CONTROL_VERBS}
+        elif album or title:
+            print("Music not found in catalog: falling back to text search")
+            # The search uses the spoken values, a fuzzy match might be a different artist or album
             if artist:
-                query_params.append(f"contributor.namesearch={'+'.join(artist.split(' '))}")
+                query_params.append(f"contributor.namesearch={'+'.join(slot_dict['artist'].split(' '))}")
             if album:
-                query_params.append(f"album.titlesearch={'+'.join(album.split(' '))}")
+                query_params.append(f"album.titlesearch={'+'.join(slot_dict['album'].split(' '))}")
             if title:
-                query_params.append(f"track.titlesearch={'+'.join(title.split(' '))}")
+                query_params.append(f"track.titlesearch={'+'.join(slot_dict['title'].split(' '))}")
             if genre:
-                query_params.append(f"genre.namesearch={'+'.join(genre.split(' '))}")
-            player.request(f"playlist shuffle 0")
-            player.request(f"playlist loadtracks {'&'.join(query_params)}")
+                query_params.append(f"genre.namesearch={'+'.join(slot_dict['genre'].split(' '))}")
+            return None, {'setup': ["playlist shuffle 0"],
+                          'items': [f"playlist {{verb}}tracks {'&'.join(query_params)}"],
+                          'verbs': CONTROL_VERBS}
         elif artist:
-            query_params = [f"contributor.namesearch={'+'.join(artist.split(' '))}"]
-            player.request("playlist shuffle 1")
-            player.request(f"playlist loadtracks {'&'.join(query_params)}")
+            query_params = [f"contributor.namesearch={'+'.join(slot_dict['artist'].split(' '))}"]
+            return None, {'setup': ["playlist shuffle 1"],
+                          'items': [f"playlist {{verb}}tracks {'&'.join(query_params)}"],
+                          'verbs': CONTROL_VERBS}
         elif genre:
-            if genre not in self.get_music_genres():
-                return "Zu dieser Stilrichtung gibt es noch keine Musik."
-            player.request("randomplaygenreselectall 0")
-            player.request(f"randomplaychoosegenre {genre} 1")
-            player.request("randomplay tracks")
+            found_genre = self.find_genre(genre)
+            if not found_genre:
+                return "Zu dieser Stilrichtung gibt es noch keine Musik.", None
+            return None, {'setup': ["randomplaygenreselectall 0",
+                                    ["randomplaychoosegenre", found_genre[0], "1"],
+                                    "randomplay tracks"],
+                          'items': []}
         else:
-            player.request("randomplaygenreselectall 1")
-            player.request("randomplay tracks")
+            return None, {'setup': ["randomplaygenreselectall 1", "randomplay tracks"], 'items': []}
 
-        return None
+    def music(self, slot_dict, request_siteid, resolution=None):
+        return self.play_content(slot_dict, request_siteid, self.resolve_music, resolution)
 
-    def podcast(self, slot_dict, request_siteid):
-        if not self.server.connected():
-            return "Der Server ist nicht erreichbar."
-        err, player = self.get_player_and_sync(slot_dict, request_siteid)
-        if err:
-            return err
+    def search_item_id(self, search_term: str, feeds: bool):
+        """
+        Searches a radio station or podcast in the web directories LMS is connected to.
+        Results are cached by the normalised search term, so repeated requests need no search.
+        :param search_term: Name of the station or podcast
+        :param feeds: Whether podcast feeds (items with subitems) or stations are searched
+        :return: item id; '' if only items of the other kind were found; None if nothing was found
+        """
+        cache_key = ('podcast' if feeds else 'radio', self.normaliser.canonical(search_term))
+        item_id = self.search_cache.get(cache_key)
+        if item_id is not None:
+            return item_id
+
+        result = self.server.request(params=["search", "items", "0", "50", f"search:{search_term}"])
+        if not result or not result.get('count'):
+            return None
+        found_items = [item_dict for item_dict in result.get('loop_loop')
+                       if bool(item_dict.get('hasitems')) == feeds]
+        item_id = found_items[0].get('id') if found_items else ''
+        if item_id:
+            self.search_cache.put(cache_key, item_id)
+        return item_id
+
+    def resolve_podcast(self, slot_dict):
+        """
+        Resolves the podcast slots to the commands which play the episodes.
+        :param slot_dict: Slot dictionary from Snips
+        :return: error, plan with 'setup' commands, 'items' command templates and their 'verbs'
+        """
         podcast_name = slot_dict.get('podcast')
         if not podcast_name:
-            return "Es wurde kein Podcast Name gesagt."
-
-        found_podcasts = list()
-        count = self.server.request(params="favorites items").get('count')
-        if count:
-            favorite_dicts = self.server.request(params=f"favorites items 0 {count}")['loop_loop']
-            music_albums = self.get_music_albums()
-            music_artists = self.get_music_artists()
-            for favorite_dict in favorite_dicts:
-                name = favorite_dict['name']
-                if name not in found_podcasts and favorite_dict['hasitems'] \
-                        and name not in music_albums and name not in music_artists and name == podcast_name:
-                    found_podcasts.append(favorite_dict)
-                    break
+            return "Es wurde kein Podcast Name gesagt.", None
 
-        if found_podcasts:
+        favorite = self.find_favorite(podcast_name, "podcast")
+        if favorite:
             # Play podcast from favorites
             result_type = "favorites"
-            podcast_id = found_podcasts[0].get('id')
-            result = player.request(f"favorites items 0 30 item_id:{podcast_id}.0")
-            if not result.get('count'):
-                return "Es gibt keine Episoden von diesem Podcast."
-            found_episodes = [item_dict for item_dict in result.get('loop_loop') if item_dict.get('isaudio')]
+            podcast_id = favorite['id']
+            found_episodes = self.episode_prefetcher.get(podcast_id) if self.episode_prefetcher else None
+            if found_episodes is None:
+                found_episodes = self.fetch_favorite_episodes(podcast_id)
+                if found_episodes is None:
+                    return "Es gibt keine Episoden von diesem Podcast.", None
+                if self.episode_prefetcher:
+                    self.episode_prefetcher.put(podcast_id, found_episodes)
             if not found_episodes:
-                return "Es gibt keine Audio Episoden zu diesem Podcast."
+                return "Es gibt keine Audio Episoden zu diesem Podcast.", None
         else:
             # Search for podcast in the web
             result_type = "podcast"
-            result = player.request(f"search items 0 30 search:{'+'.join(podcast_name.split(' '))}")
-            if result.get('count'):
-                found_podcasts = [item_dict for item_dict in result.get('loop_loop')
-                                  if item_dict.get('hasitems')]
-            if not found_podcasts:
-                return "Es gibt keinen solchen Podcast."
-
-            podcast_id = found_podcasts[0].get('id')
-            result = player.request(f"search items 0 50 item_id:{podcast_id}.0")
-            if not result.get('count'):
-                return "Es gibt keine Episoden von diesem Podcast."
-            found_episodes = [item_dict for item_dict in result.get('loop_loop') if item_dict.get('isaudio')]
+            podcast_id = self.search_item_id(podcast_name, feeds=True)
+            if not podcast_id:
+                return "Es gibt keinen solchen Podcast.", None
+
+            cache_key = ('episodes', podcast_id)
+            found_episodes = self.search_cache.get(cache_key)
+            if found_episodes is None:
+                result = self.server.request(params=f"search items 0 50 item_id:{podcast_id}.0")
+                if not result.get('count'):
+                    return "Es gibt keine Episoden von diesem Podcast.", None
+                found_episodes = [item_dict for item_dict in result.get('loop_loop') if item_dict.get('isaudio')]
+                if found_episodes:
+                    self.search_cache.put(cache_key, found_episodes, self.episodes_cache_ttl)
             if not found_episodes:
-                return "Es gibt keine Audio Episoden zu diesem Podcast."
+                return "Es gibt keine Audio Episoden zu diesem Podcast.", None
 
         if not slot_dict.get('index') and not slot_dict.get('count'):
             episode_ids = [found_episodes[0].get('id')]
@@ -575,37 +1665,43 @@ class LMSController:
             index = slot_dict.get('index')
             count = slot_dict.get('count')
             if index and index > len(found_episodes) or count and count > len(found_episodes):
-                return "Es gibt nicht so viele Episoden in diesem Podcast."
+                return "Es gibt nicht so viele Episoden in diesem Podcast.", None
             if index:
                 episode_ids = [found_episodes[index - 1].get('id')]
             else:
                 episode_ids = [episode.get('id') for episode in found_episodes[:count]]
-        for episode_id in episode_ids:
-            if episode_id == episode_ids[0]:
-                player.request(f"{result_type} playlist play item_id:{episode_id}")
-            else:
-                player.request(f"{result_type} playlist add item_id:{episode_id}")
+        return None, {'setup': [], 'items': [f"{result_type} playlist {{verb}} item_id:{episode_id}"
+                                             for episode_id in episode_ids]}
 
-    def radio(self, slot_dict, request_siteid):
-        if not self.server.connected():
-            return "Der Server ist nicht erreichbar."
-        err, player = self.get_player_and_sync(slot_dict, request_siteid)
-        if err:
-            return err
+    def podcast(self, slot_dict, request_siteid, resolution=None):
+        return self.play_content(slot_dict, request_siteid, self.resolve_podcast, resolution)
+
+    def resolve_radio(self, slot_dict):
+        """
+        Resolves the radio slot to the command which plays the station.
+        :param slot_dict: Slot dictionary from Snips
+        :return: error, plan with 'setup' commands, 'items' command templates and their 'verbs'
+        """
         station_name = slot_dict.get('radio')
         if not station_name:
-            favorite_stations = self.get_radio_stations()
+            favorite_stations = [favorite for favorite in self.get_favorites_index().values()
+                                 if favorite['type'] == "radio"]
             if not favorite_stations:
-                return "Es wurde kein Sender genannt und es gibt keine Sender in den Favoriten."
-            station_name = random.choice(favorite_stations)
-        result = player.request(f"search items 0 50 search:{'+'.join(station_name.split(' '))}")
-        if not result.get('count'):
-            return "Es gibt keinen solchen Radiosender."
-        found_stations = [item_dict for item_dict in result.get('loop_loop') if not item_dict.get('hasitems')]
-        if not found_stations:
-            return "Es gibt nur Podcasts mit so einem Namen."
-        station_id = found_stations[0].get('id')
-        player.request(f"podcast playlist play item_id:{station_id}")
+                return "Es wurde kein Sender genannt und es gibt keine Sender in den Favoriten.", None
+            favorite = random.choice(favorite_stations)
+        else:
+            favorite = self.find_favorite(station_name, "radio")
+        if favorite:
+            return None, {'setup': [], 'items': [f"favorites playlist {{verb}} item_id:{favorite['id']}"]}
+        station_id = self.search_item_id(station_name, feeds=False)
+        if station_id is None:
+            return "Es gibt keinen solchen Radiosender.", None
+        if not station_id:
+            return "Es gibt nur Podcasts mit so einem Namen.", None
+        return None, {'setup': [], 'items': [f"podcast playlist {{verb}} item_id:{station_id}"]}
+
+    def radio(self, slot_dict, request_siteid, resolution=None):
+        return self.play_content(slot_dict, request_siteid, self.resolve_radio, resolution)
 
     def player_pause(self, slot_dict, request_siteid):
         # TODO: pause not working if player is synced with others
@@ -678,6 +1774,24 @@ class LMSController:
                                 args=(master_site, slave_site,), sites=[master_site, slave_site])
         return None
 
+    def snapshot_players(self, players: list) -> dict:
+        """
+        Saves the playlists, positions and volumes of several players at the same time,
+        e.g. before an interruption replaces their queue.
+        :param players: list of LMSPlayer objects
+        :return: dictionary with MAC address and snapshot of each player
+        """
+        return self.fetch_concurrently({player.ref: player.snapshot for player in players})
+
+    def restore_players(self, players: list, snapshots: dict):
+        """
+        Restores the snapshots of several players, e.g. of synced rooms, at the same time.
+        :param players: list of LMSPlayer objects
+        :param snapshots: dictionary with MAC address and snapshot as returned by snapshot_players
+        """
+        self.fetch_concurrently({player.ref: lambda p=player: p.restore(snapshots[p.ref])
+                                 for player in players if player.ref in snapshots})
+
     @staticmethod
     def player_sync_step2(master_site, slave_site):
         master_device = master_site.active_device
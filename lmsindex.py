@@ -0,0 +1,182 @@
+"""
+Local fuzzy index to resolve spoken slot values to exact catalog entries.
+Names are matched by their German phonetic key (Kölner Phonetik) and by trigram similarity,
+so slightly misspelled values can be resolved without a text search on the server.
+"""
+
+import heapq
+import math
+import time
+from array import array
+
+
+_VOWELS = set("aeijouy")
+
+
+def cologne_phonetics(word: str) -> str:
+    """
+    Returns the Kölner Phonetik code of a word, e.g. "Müller" -> "657".
+    The word should already be casefolded; umlauts and ß are folded here.
+    """
+    word = ''.join(c for c in word.replace('ä', 'a').replace('ö', 'o').replace('ü', 'u').replace('ß', 's')
+                   if c.isalpha())
+    codes = list()
+    for i, c in enumerate(word):
+        before = word[i - 1] if i > 0 else ''
+        after = word[i + 1] if i + 1 < len(word) else ''
+        if c in _VOWELS:
+            code = "0"
+        elif c == 'h':
+            continue
+        elif c == 'b':
+            code = "1"
+        elif c == 'p':
+            code = "3" if after == 'h' else "1"
+        elif c in "dt":
+            code = "8" if after in ("c", "s", "z") else "2"
+        elif c in "fvw":
+            code = "3"
+        elif c in "gkq":
+            code = "4"
+        elif c == 'c':
+            if i == 0:
+                code = "4" if after and after in "ahkloqrux" else "8"
+            else:
+                code = "4" if after and after in "ahkoqux" and before not in ("s", "z") else "8"
+        elif c == 'x':
+            code = "8" if before and before in "ckq" else "48"
+        elif c == 'l':
+            code = "5"
+        elif c in "mn":
+            code = "6"
+        elif c == 'r':
+            code = "7"
+        elif c in "sz":
+            code = "8"
+        else:
+            continue
+        codes.append(code)
+
+    result = ""
+    for code in ''.join(codes):
+        if not result or result[-1] != code:
+            result += code
+    return result[:1] + result[1:].replace("0", "")
+
+
+def phonetic_key(name: str) -> str:
+    return " ".join(cologne_phonetics(word) for word in name.split())
+
+
+def trigrams(name: str) -> set:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_postings(canonical_names) -> (dict, dict):
+    """
+    Builds the posting lists of the fuzzy index. They are built when the catalog is written and
+    stored in the catalog file.
+    :param canonical_names: iterable of canonical names in the order of the catalog mapping table
+    :return: dictionaries with phonetic key and trigram and array('I') of the positions of their names
+    """
+    phonetic = dict()
+    postings = dict()
+    for name_id, name in enumerate(canonical_names):
+        phonetic.setdefault(phonetic_key(name), array('I')).append(name_id)
+        for trigram in trigrams(name):
+            postings.setdefault(trigram, array('I')).append(name_id)
+    return phonetic, postings
+
+
+def positions(packed):
+    """
+    :param packed: memoryview of a packed posting list in the catalog or None
+    :return: sequence of the positions, without copying them
+    """
+    return packed.cast('I') if packed else ()
+
+
+class FuzzyIndex:
+    """
+    Phonetic and trigram index over the canonical names of one catalog table.
+    The posting lists are read from the memory-mapped catalog (see build_postings), so the
+    index costs neither build time nor heap in the main process.
+    :param names: mapping table of the catalog with "canonical\0original" entries
+    :param phonetic: table with phonetic keys and the packed positions of their names
+    :param postings: table with trigrams and the packed positions of their names
+    """
+
+    def __init__(self, names, phonetic, postings):
+        self.names = names
+        self.phonetic = phonetic
+        self.postings = postings
+
+    def entry(self, name_id: int) -> (str, str):
+        """
+        :return: canonical and original name at a position of the mapping table
+        """
+        canonical_name, original = self.names.raw(name_id).split(b"\0", 1)
+        return canonical_name.decode("utf-8"), original.decode("utf-8")
+
+    def resolve(self, canonical_name: str, min_similarity: float = 0.7, min_similarity_other_sound: float = 0.9,
+                budget: float = 0.001):
+        """
+        Finds the most similar name. Names with the same phonetic key are preferred; otherwise
+        the name with the highest trigram similarity (Dice coefficient) is taken.
+        A name which does not sound the same needs a higher similarity, so that e.g. a missing
+        "Künstler 99" is not resolved to "Künstler 29".
+        A match must share a minimum number of trigrams with the value, so only the rarest posting
+        lists are scanned: every match is contained in at least one of them. If the time budget
+        runs out during the scan, only the names with the same phonetic key are considered.
+        :param canonical_name: Canonical form of the spoken value
+        :param min_similarity: Minimum trigram similarity of a match with the same phonetic key
+        :param min_similarity_other_sound: Minimum trigram similarity of a match with another phonetic key
+        :param budget: Time budget in seconds
+        :return: original LMS name or None
+        """
+        deadline = time.perf_counter() + budget
+        query_trigrams = trigrams(canonical_name)
+
+        same_sound = positions(self.phonetic.lookup_view(phonetic_key(canonical_name)))
+        same_sound_ids = set(same_sound)
+
+        # 2 * shared / (query + name) >= similarity and shared <= name give the minimum of shared trigrams
+        min_shared = math.ceil(min_similarity * len(query_trigrams) / (2 - min_similarity))
+        posting_lists = sorted((positions(self.postings.lookup_view(trigram)) for trigram in query_trigrams), key=len)
+        scanned_lists = posting_lists[:len(posting_lists) - min_shared + 1]
+        skipped = len(posting_lists) - len(scanned_lists)
+
+        shared = dict()
+        complete = True
+        for posting_list in scanned_lists:
+            for start in range(0, len(posting_list), 1024):
+                if time.perf_counter() > deadline:
+                    complete = False
+                    break
+                for name_id in posting_list[start:start + 1024]:
+                    shared[name_id] = shared.get(name_id, 0) + 1
+            if not complete:
+                break
+
+        if complete:
+            candidates = [name_id for name_id, count in shared.items() if count + skipped >= min_shared]
+            candidates = set(heapq.nlargest(20, candidates, key=shared.get))
+            candidates.update(heapq.nlargest(20, same_sound, key=lambda name_id: shared.get(name_id, 0)))
+        else:
+            # Partly counted posting lists would rank the candidates wrongly
+            candidates = set(same_sound[:20])
+
+        best_name, best_score = None, 0.0
+        for name_id in candidates:
+            candidate, original = self.entry(name_id)
+            candidate_trigrams = trigrams(candidate)
+            similarity = 2 * len(query_trigrams & candidate_trigrams) / (len(query_trigrams) + len(candidate_trigrams))
+            sounds_same = name_id in same_sound_ids
+            if similarity < (min_similarity if sounds_same else min_similarity_other_sound):
+                continue
+            # The phonetic key only ranks the matches, it does not make a dissimilar name a match
+            score = similarity + 0.25 if sounds_same else similarity
+            if score > best_score:
+                best_name, best_score = original, score
+        return best_name
@@ -0,0 +1,139 @@
+"""
+Normalisation of library names and spoken slot values.
+All steps are compiled once, so the pipeline can be applied in bulk while building the catalog.
+The canonical form of a name is used as key to find the original LMS name again.
+"""
+
+import re
+import unicodedata
+
+
+DEFAULT_SPLIT_PATTERNS = {
+    'artists': r'; |;|, |,',
+    'genres': r'; |;|, |,|/| / ',
+}
+
+_UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss', 'Ä': 'Ae', 'Ö': 'Oe', 'Ü': 'Ue'})
+_FEATURING = re.compile(r'(?<=\S)\s+[(\[]?(feat\.|ft\.|featuring)\s.*$', re.IGNORECASE)
+_NUMBER = re.compile(r'\d+')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+_ONES = ["null", "eins", "zwei", "drei", "vier", "fünf", "sechs", "sieben", "acht", "neun", "zehn",
+         "elf", "zwölf", "dreizehn", "vierzehn", "fünfzehn", "sechzehn", "siebzehn", "achtzehn", "neunzehn"]
+_TENS = ["", "", "zwanzig", "dreißig", "vierzig", "fünfzig", "sechzig", "siebzig", "achtzig", "neunzig"]
+
+
+def number_to_words(number: int) -> str:
+    """
+    Spells a number in German like the speech recognition does, e.g. 21 -> einundzwanzig.
+    Numbers from one million on are returned as digits.
+    """
+    if number < 20:
+        return _ONES[number]
+    if number < 100:
+        ones, tens = number % 10, number // 10
+        if not ones:
+            return _TENS[tens]
+        return ("ein" if ones == 1 else _ONES[ones]) + "und" + _TENS[tens]
+    if number < 1000:
+        hundreds, rest = divmod(number, 100)
+        prefix = ("ein" if hundreds == 1 else _ONES[hundreds]) + "hundert"
+        return prefix + (number_to_words(rest) if rest else "")
+    if number < 1000000:
+        thousands, rest = divmod(number, 1000)
+        prefix = ("ein" if thousands == 1 else number_to_words(thousands)) + "tausend"
+        return prefix + (number_to_words(rest) if rest else "")
+    return str(number)
+
+
+class Normaliser:
+    """
+    Configurable normalisation pipeline.
+    :param split_patterns: dictionary with entity name and regular expression to split one name into several
+    :param casefold: Whether case differences are ignored
+    :param fold_umlauts: Whether umlauts, ß and accents are folded to ASCII
+    :param strip_featuring: Whether "feat." and everything after it is removed
+    :param expand_numbers: Whether digits are spelled out as German number words
+    """
+
+    def __init__(self, split_patterns: dict = None, casefold=True, fold_umlauts=True, strip_featuring=True,
+                 expand_numbers=True):
+        if split_patterns is None:
+            split_patterns = DEFAULT_SPLIT_PATTERNS
+        self.options = {'split_patterns': split_patterns, 'casefold': casefold, 'fold_umlauts': fold_umlauts,
+                        'strip_featuring': strip_featuring, 'expand_numbers': expand_numbers}
+        self.split_regexes = {entity: re.compile(pattern) for entity, pattern in split_patterns.items() if pattern}
+        self.steps = list()
+        if casefold:
+            self.steps.append(str.casefold)
+        if strip_featuring:
+            self.steps.append(self.strip_featuring)
+        if expand_numbers:
+            self.steps.append(lambda name: _NUMBER.sub(lambda match: f" {number_to_words(int(match[0]))} ", name))
+        if fold_umlauts:
+            self.steps.append(self.fold)
+        self.steps.append(lambda name: _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', name)).strip())
+
+    @classmethod
+    def from_config(cls, section: dict):
+        """
+        Creates the pipeline from the [normalisation] section of the configuration file.
+        """
+        def option(name, default):
+            value = section.get(name)
+            return default if value is None else value.strip('"')
+
+        def flag(name):
+            return option(name, "1").lower() not in ["0", "false", "no", "off"]
+
+        return cls(
+            split_patterns={entity: option(f"split_{entity}", pattern)
+                            for entity, pattern in DEFAULT_SPLIT_PATTERNS.items()},
+            casefold=flag("casefold"),
+            fold_umlauts=flag("fold_umlauts"),
+            strip_featuring=flag("strip_featuring"),
+            expand_numbers=flag("expand_numbers"),
+        )
+
+    @staticmethod
+    def fold(name: str) -> str:
+        name = name.translate(_UMLAUTS)
+        return ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+
+    def split(self, entity: str, value: str) -> list:
+        """
+        Splits a library value like "Artist A, Artist B" into single names.
+        """
+        regex = self.split_regexes.get(entity)
+        if not regex:
+            return [value]
+        return [name.strip() for name in regex.split(value) if name.strip()]
+
+    @staticmethod
+    def strip_featuring(name: str) -> str:
+        """
+        Removes "feat." and everything after it, e.g. "Song (feat. Artist)" -> "Song".
+        A name which would be stripped to nothing is kept unchanged.
+        """
+        stripped = _FEATURING.sub('', name)
+        return stripped if _PUNCTUATION.sub('', stripped).strip() else name
+
+    def canonical(self, name: str) -> str:
+        for step in self.steps:
+            name = step(name)
+        return name
+
+    def build_mapping(self, names) -> dict:
+        """
+        Maps the canonical form of each name to the first original name with this form.
+        :param names: iterable of original names
+        :return: dictionary with canonical name and original name
+        """
+        mapping = dict()
+        canonical = self.canonical
+        for name in names:
+            key = canonical(name)
+            if key and key not in mapping:
+                mapping[key] = name
+        return mapping
@@ -0,0 +1,163 @@
+"""
+Background prefetch of the episode lists of favorite podcasts.
+Each podcast has its own schedule. The first refreshes are staggered over the interval, so the
+feeds are not all fetched at once. A feed which did not change is refreshed less often (up to the
+maximum interval); a changed feed is refreshed at the normal interval again.
+"""
+
+import heapq
+import threading
+import time
+
+import requests
+
+
+class EpisodePrefetcher(threading.Thread):
+    """
+    :param list_podcasts: function returning a list of podcast dictionaries with id, name and url
+    :param fetch_episodes: function returning the list of audio episode dictionaries of a podcast id
+    :param interval: Normal refresh interval of a podcast in seconds
+    :param max_interval: Longest refresh interval of an unchanged or failing podcast in seconds
+    :param sync_interval: Interval in seconds in which the list of podcasts is checked for changes
+    """
+
+    def __init__(self, list_podcasts, fetch_episodes, interval=900, max_interval=21600, sync_interval=300):
+        super().__init__(daemon=True)
+        self.list_podcasts = list_podcasts
+        self.fetch_episodes = fetch_episodes
+        self.interval = interval
+        self.max_interval = max_interval
+        self.sync_interval = sync_interval
+        self.episodes = dict()
+        self.schedules = dict()
+        self.queue = list()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.abort = False
+        self.sync_now = False
+        self.session = requests.Session()
+
+    def get(self, podcast_id: str):
+        """
+        :return: prefetched list of episode dictionaries or None if the podcast was not fetched yet
+        """
+        with self.lock:
+            return self.episodes.get(podcast_id)
+
+    def put(self, podcast_id: str, episodes: list):
+        with self.lock:
+            self.episodes[podcast_id] = episodes
+
+    def sync(self):
+        """
+        Schedules new podcasts staggered over the interval and forgets removed ones.
+        """
+        podcasts = {podcast['id']: podcast for podcast in self.list_podcasts()}
+        now = time.monotonic()
+        with self.lock:
+            for podcast_id in set(self.schedules) - set(podcasts):
+                del self.schedules[podcast_id]
+                self.episodes.pop(podcast_id, None)
+            new_ids = [podcast_id for podcast_id in podcasts if podcast_id not in self.schedules]
+            for position, podcast_id in enumerate(new_ids):
+                due = now + position * self.interval / len(new_ids)
+                self.schedules[podcast_id] = {'podcast': podcasts[podcast_id], 'interval': self.interval,
+                                              'etag': None, 'last_modified': None, 'latest': None, 'due': due}
+                heapq.heappush(self.queue, (due, podcast_id))
+            for podcast_id, podcast in podcasts.items():
+                self.schedules[podcast_id]['podcast'] = podcast
+
+    def feed_unchanged(self, schedule: dict) -> bool:
+        """
+        Asks the server of the feed with a conditional request whether the feed changed since
+        the last refresh and remembers the validators (ETag, Last-Modified) of the answer.
+        :return: True if the server answered "304 Not Modified"
+        """
+        url = schedule['podcast'].get('url')
+        if not url or not url.startswith("http"):
+            return False
+        headers = dict()
+        if schedule['etag']:
+            headers['If-None-Match'] = schedule['etag']
+        if schedule['last_modified']:
+            headers['If-Modified-Since'] = schedule['last_modified']
+        try:
+            response = self.session.head(url, headers=headers, timeout=10, allow_redirects=True)
+        except requests.RequestException:
+            return False
+        if response.status_code == 304:
+            return bool(headers)
+        schedule['etag'] = response.headers.get('ETag')
+        schedule['last_modified'] = response.headers.get('Last-Modified')
+        return False
+
+    def refresh(self, podcast_id: str) -> float:
+        """
+        Refreshes the episodes of one podcast.
+        :return: seconds until the next refresh of this podcast
+        """
+        with self.lock:
+            schedule = self.schedules[podcast_id]
+        changed = False
+        if not self.feed_unchanged(schedule) or self.get(podcast_id) is None:
+            try:
+                episodes = self.fetch_episodes(podcast_id)
+            except Exception as e:
+                # e.g. connection errors or answers without episode list; the next refresh is tried later
+                print(f"Prefetching episodes of {schedule['podcast'].get('name')} failed: {e!r}")
+                episodes = None
+            if episodes is not None:
+                latest = episodes[0].get('id') if episodes else None
+                changed = latest != schedule['latest']
+                schedule['latest'] = latest
+                self.put(podcast_id, episodes)
+
+        if changed:
+            schedule['interval'] = self.interval
+        else:
+            schedule['interval'] = min(schedule['interval'] * 2, self.max_interval)
+        return schedule['interval']
+
+    def run(self):
+        next_sync = 0
+        while not self.abort:
+            now = time.monotonic()
+            if now >= next_sync or self.sync_now:
+                self.sync_now = False
+                try:
+                    self.sync()
+                except Exception as e:
+                    # The thread has to survive any error, otherwise prefetching would stop for good
+                    print(f"Prefetching episodes: podcasts could not be listed: {e!r}")
+                next_sync = now + self.sync_interval
+            with self.lock:
+                due, podcast_id = self.queue[0] if self.queue else (next_sync, None)
+            if podcast_id is None or due > now:
+                self.wakeup.wait(min(due, next_sync) - now)
+                self.wakeup.clear()
+                continue
+            with self.lock:
+                heapq.heappop(self.queue)
+                schedule = self.schedules.get(podcast_id)
+            # Entries of removed podcasts or outdated entries of podcasts added again are dropped
+            if schedule is None or schedule['due'] != due:
+                continue
+            try:
+                delay = self.refresh(podcast_id)
+            except Exception as e:
+                print(f"Prefetching episodes of {schedule['podcast'].get('name')} failed: {e!r}")
+                delay = schedule['interval'] = min(schedule['interval'] * 2, self.max_interval)
+            with self.lock:
+                schedule['due'] = time.monotonic() + delay
+                heapq.heappush(self.queue, (schedule['due'], podcast_id))
+
+    def resync(self):
+        """
+        Checks the list of podcasts on the next occasion, e.g. after the favorites changed.
+        """
+        self.sync_now = True
+        self.wakeup.set()
+
+    def stop(self):
+        self.abort = True
+        self.wakeup.set()